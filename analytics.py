@@ -0,0 +1,165 @@
+from datetime import date, timedelta
+
+import numpy as np
+
+import database
+from storage import parse_date
+
+# ordinal of the first day of the NumPy datetime64 epoch
+EPOCH = date(1970, 1, 1).toordinal()
+
+
+def period_days(periodicity, habit_date, day):
+    """
+    Returns the ordinals of the first and the last day of the period (day, week, or month) of a habit that contains the
+    given day. Weeks are counted from the day on which the habit was created, months are calendar months (as in
+    Habit.period_index).
+    """
+    if periodicity == 'weekly':
+        start = habit_date + timedelta(weeks=(day - habit_date).days // 7)
+        return start.toordinal(), start.toordinal() + 6
+    if periodicity == 'monthly':
+        start = day.replace(day=1)
+        end = date(day.year + day.month // 12, day.month % 12 + 1, 1) - timedelta(days=1)
+        return start.toordinal(), end.toordinal()
+    return day.toordinal(), day.toordinal()
+
+
+def completion_matrix(storage):
+    """
+    Builds the completion matrices of all habits from their logged and archived dates. Returns the sorted habit names,
+    the days from the creation of the first habit to the last stored date (as datetime64[D]) and three habits x days
+    arrays:
+
+    - the completions, which are 1 on the days on which a habit was completed,
+    - the completed periods, which are 1 on all days of the periods (for weekly and monthly habits, the whole week or
+      month) in which a habit was completed,
+    - the active days, which are True from the day on which a habit was created. A habit can't be completed before,
+      so those days are left out of its rates.
+    """
+    habits = sorted(storage.view_all_info(), key=lambda habit: habit.habit_name)
+    habit_names = [habit.habit_name for habit in habits]
+    first_days = []
+    completions = []
+    last_day = 0
+    for row, habit in enumerate(habits):
+        habit_date = parse_date(habit.habit_date).date()
+        first_days.append(habit_date.toordinal())
+        completed_dates, not_completed_dates = storage.view_dates(habit.habit_name)
+        for completed_date in completed_dates:
+            completions.append((row, *period_days(habit.periodicity, habit_date, completed_date.date()),
+                                completed_date.toordinal()))
+        # the missed days are only needed for the range of the matrix
+        last_day = max([last_day, first_days[-1]]
+                       + [day.toordinal() for day in completed_dates + not_completed_dates])
+
+    if not habits:
+        return habit_names, np.array([], dtype='datetime64[D]'), np.zeros((0, 0), dtype=np.int8), \
+            np.zeros((0, 0), dtype=np.int8), np.zeros((0, 0), dtype=bool)
+
+    first_day = min(first_days)
+    size = last_day - first_day + 1
+    matrix = np.zeros((len(habits), size), dtype=np.int8)
+    period_matrix = np.zeros((len(habits), size), dtype=np.int8)
+    for row, start, end, day in completions:
+        if first_day <= day <= last_day:
+            matrix[row, day - first_day] = 1
+        period_matrix[row, max(start - first_day, 0):max(end - first_day + 1, 0)] = 1
+
+    active = np.arange(size) >= (np.array(first_days) - first_day)[:, np.newaxis]
+    matrix *= active
+    period_matrix *= active
+    all_days = (np.arange(first_day, last_day + 1) - EPOCH).astype('datetime64[D]')
+    return habit_names, all_days, matrix, period_matrix, active
+
+
+class Analytics:
+    """
+    Compares the habits with each other: which habits are completed on the same days, which habit predicts another
+    one and on which weekdays and in which months they are done. All results are computed with matrix operations on
+    the habits x days completion matrices, whose rows are in the order of self.habit_names. Every habit is only
+    counted on the days since its creation (self.active).
+    """
+
+    def __init__(self, storage=None):
+        # Without a storage, the SQLite database is used.
+        self.storage = storage if storage is not None else database.SQLiteStorage()
+        self.storage.roll_over_once()
+        self.habit_names, self.days, self.matrix, self.period_matrix, self.active = completion_matrix(self.storage)
+
+    def co_completion(self):
+        """
+        Returns a habits x habits array with the number of days on which both habits were completed, counting all
+        days of a completed week or month for weekly and monthly habits. The diagonal holds the number of these days
+        for each habit.
+        """
+        matrix = self.period_matrix.astype(np.int64)
+        return matrix @ matrix.T
+
+    def correlation(self):
+        """
+        Returns a habits x habits array with the Pearson correlation of the completed periods of two habits, over the
+        days on which both habits existed. Habits that were completed on every one of these days or on none have no
+        correlation, which is reported as 0.
+        """
+        completed = self.period_matrix.astype(np.float64)
+        active = self.active.astype(np.float64)
+        days = active @ active.T
+        # sums of the completions of the first habit over the days on which the second one existed (the completions
+        # are 0 or 1, so these are also the sums of their squares) and of the completions on the same day
+        first = completed @ active.T
+        both = completed @ completed.T
+
+        covariance = both - np.divide(first * first.T, days, out=np.zeros_like(days), where=days > 0)
+        variance = np.maximum(first - np.divide(first ** 2, days, out=np.zeros_like(days), where=days > 0), 0)
+        norm = np.sqrt(variance * variance.T)
+        return np.divide(covariance, norm, out=np.zeros_like(covariance), where=norm > 0)
+
+    def lift(self, lag=1):
+        """
+        Returns a habits x habits array with the lift of "habit A predicts habit B": the probability that B is
+        completed lag days after a day on which A was completed, divided by the probability that B is completed on
+        any day since its creation. A value above 1 means that B is completed more often after A. Pairs without data
+        are 0.
+        """
+        days = self.period_matrix.shape[1] - lag
+        if days <= 0:
+            return np.zeros((len(self.habit_names), len(self.habit_names)))
+        before = self.period_matrix[:, :days].astype(np.int64)
+        after = self.period_matrix[:, lag:].astype(np.int64)
+        after_active = self.active[:, lag:].astype(np.int64)
+
+        # P(B after A) = days with A and B lag days later / days with A on which B existed lag days later
+        together = before @ after.T
+        a_days = before @ after_active.T
+        b_rate = np.divide(after.sum(axis=1), after_active.sum(axis=1), out=np.zeros(len(after)),
+                           where=after_active.sum(axis=1) > 0)
+        expected = a_days * b_rate
+        return np.divide(together, expected, out=np.zeros(together.shape), where=expected > 0)
+
+    def weekday_profile(self):
+        """
+        Returns a habits x 7 array with the completion rate of each habit per weekday, Monday first.
+        """
+        # 1970-01-01 was a Thursday
+        weekdays = (self.days.astype(np.int64) + 3) % 7
+        return self.profile(weekdays, 7)
+
+    def seasonality_profile(self):
+        """
+        Returns a habits x 12 array with the completion rate of each habit per month of the year, January first.
+        """
+        months = self.days.astype('datetime64[M]').astype(np.int64) % 12
+        return self.profile(months, 12)
+
+    def profile(self, groups, size):
+        """
+        Returns the completion rate of each habit over its active days of each group: the days on which it was
+        completed divided by the days since its creation in the group. The groups are numbered from 0 to size - 1 and
+        given per day of the matrix.
+        """
+        one_hot = np.zeros((len(groups), size), dtype=np.int64)
+        one_hot[np.arange(len(groups)), groups] = 1
+        completions = self.matrix.astype(np.int64) @ one_hot
+        group_days = self.active.astype(np.int64) @ one_hot
+        return np.divide(completions, group_days, out=np.zeros(completions.shape), where=group_days > 0)
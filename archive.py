@@ -0,0 +1,208 @@
+import mmap
+import os
+import shutil
+import struct
+import sys
+from array import array
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+from storage import parse_date
+
+# name of the archive directory, which lies next to the database file
+ARCHIVE_DIR = 'archive'
+
+# events older than this are moved from the dates table into the archive
+ARCHIVE_HORIZON = timedelta(days=365)
+
+# An archive file is a sequence of segments, one per run of archive_events that archived events of the habit. Every
+# segment starts with this magic, the number of its events and the id of the last one, followed by the date ordinals of
+# the events (little-endian 32-bit integers, in log order) and a bitmap in which bit i is set if event i was a completed
+# period. The bitmap is padded to a multiple of 4 bytes, so the ordinals of every segment are aligned.
+MAGIC = b'HTS1'
+HEADER = struct.Struct('<4sIQ')
+
+# Archives written before the segments consist of a single segment with this magic and header (without the id of the
+# last event) and an unpadded bitmap.
+LEGACY_MAGIC = b'HTA1'
+LEGACY_HEADER = struct.Struct('<4sI')
+
+
+def archive_path(archive_dir, habit_name):
+    """
+    Returns the path of the archive file of a habit. The name is quoted, so any habit name gives a valid file name.
+    """
+    return os.path.join(archive_dir, quote(habit_name, safe='') + '.bin')
+
+
+def scan_segments(buffer):
+    """
+    Yields (offset of the ordinals, number of events, id of the last event, end offset) for every complete segment of
+    an archive. A segment that was cut short because archive_events was interrupted is not yielded.
+    """
+    offset = 0
+    while offset + LEGACY_HEADER.size <= len(buffer):
+        magic, count = LEGACY_HEADER.unpack_from(buffer, offset)
+        if magic == LEGACY_MAGIC and offset == 0:
+            ordinals = LEGACY_HEADER.size
+            last_event_id = 0
+            end = ordinals + count * 4 + (count + 7) // 8
+        elif magic == MAGIC and offset + HEADER.size <= len(buffer):
+            _, count, last_event_id = HEADER.unpack_from(buffer, offset)
+            ordinals = offset + HEADER.size
+            end = ordinals + count * 4 + (count + 31) // 32 * 4
+        elif magic == MAGIC:
+            return
+        else:
+            raise ValueError("Not a habit archive.")
+        if end > len(buffer):
+            return
+        yield ordinals, count, last_event_id, end
+        offset = end
+
+
+def read_archive(archive_dir, habit_name):
+    """
+    Maps the archive file of a habit into memory and returns the list of its segments as (date ordinals, status bitmap)
+    memoryviews, without copying or parsing them, and the id of the last archived event. A habit without an archive
+    has no archived events and 0 as the last archived event.
+    """
+    try:
+        with open(archive_path(archive_dir, habit_name), 'rb') as file:
+            archive = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        # ValueError: an empty file can't be mapped
+        return [], 0
+
+    view = memoryview(archive)
+    segments = []
+    last_archived = 0
+    for ordinals, count, last_event_id, end in scan_segments(view):
+        ordinals_view = view[ordinals:ordinals + count * 4].cast('i')
+        if sys.byteorder == 'big':
+            ordinals_view = array('i', ordinals_view)
+            ordinals_view.byteswap()
+            ordinals_view = memoryview(ordinals_view)
+        segments.append((ordinals_view, view[ordinals + count * 4:end]))
+        last_archived = max(last_archived, last_event_id)
+    return segments, last_archived
+
+
+def archived_dates(archive_dir, habit_name):
+    """
+    Returns two lists with the dates when the habit was completed and not completed, read from its archive, and the
+    id of the last archived event.
+    """
+    segments, last_archived = read_archive(archive_dir, habit_name)
+    completed_dates = []
+    not_completed_dates = []
+    for ordinals, bitmap in segments:
+        for i, ordinal in enumerate(ordinals):
+            if bitmap[i >> 3] >> (i & 7) & 1:
+                completed_dates.append(datetime.fromordinal(ordinal))
+            else:
+                not_completed_dates.append(datetime.fromordinal(ordinal))
+    return completed_dates, not_completed_dates, last_archived
+
+
+def complete_size(file):
+    """
+    Returns the size of the complete segments of an open archive file.
+    """
+    if os.fstat(file.fileno()).st_size == 0:
+        return 0
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        return max((end for *_, end in scan_segments(buffer)), default=0)
+
+
+def append_archive(archive_dir, habit_name, events, last_event_id):
+    """
+    Appends a list of (date ordinal, completed) events, the last of which has the id last_event_id, as a new segment
+    to the archive file of a habit. A segment that an interrupted run left behind is cut off first. The file is
+    flushed to the disk before returning, so the events can be deleted from the database afterwards.
+    """
+    ordinals = array('i', [ordinal for ordinal, completed in events])
+    if sys.byteorder == 'big':
+        ordinals.byteswap()
+    bitmap = bytearray((len(events) + 31) // 32 * 4)
+    for i, (ordinal, completed) in enumerate(events):
+        if completed:
+            bitmap[i >> 3] |= 1 << (i & 7)
+
+    os.makedirs(archive_dir, exist_ok=True)
+    with open(archive_path(archive_dir, habit_name), 'a+b') as file:
+        file.truncate(complete_size(file))
+        file.write(HEADER.pack(MAGIC, len(events), last_event_id))
+        file.write(ordinals.tobytes())
+        file.write(bitmap)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def delete_archive(archive_dir, habit_name):
+    """
+    Deletes the archive file of a habit, if it has one.
+    """
+    try:
+        os.remove(archive_path(archive_dir, habit_name))
+    except FileNotFoundError:
+        pass
+
+
+def clear_archive(archive_dir):
+    """
+    Deletes the archive files of all habits.
+    """
+    shutil.rmtree(archive_dir, ignore_errors=True)
+
+
+def archive_events(storage, horizon=ARCHIVE_HORIZON):
+    """
+    Moves all events older than the horizon from the dates table of an SQLiteStorage into the archive files of their
+    habits. The log is compacted first and only events that are already part of a snapshot are archived, so the habit
+    state can still be rebuilt from the dates table alone. Returns the number of archived events.
+
+    Every run only appends the newly archived events to the archives. The events of a habit are archived in log order
+    up to the first one that is too recent, so the archive holds every event up to its last archived event, and the
+    dates table keeps the events after it. If a run was interrupted after writing an archive, the events it already
+    archived are deleted from the dates table by the next run.
+    """
+    storage.compact_log()
+    cutoff = datetime.now() - horizon
+
+    db = storage.connect()
+    c = db.cursor()
+    c.execute("SELECT habit_name, snapshot_event FROM habits /* whole table */")
+    archived = 0
+    for habit_name, snapshot_event in c.fetchall():
+        last_archived = read_archive(storage.archive_dir, habit_name)[1]
+        c.execute("""SELECT event_id, completed_date, not_completed_date FROM dates
+                    WHERE habit_name = ? AND event_id > ? AND event_id <= ? ORDER BY event_id""",
+                  (habit_name, last_archived, snapshot_event))
+        old_events = []
+        for event_id, completed_date, not_completed_date in c.fetchall():
+            event_date = parse_date(completed_date or not_completed_date)
+            if event_date >= cutoff:
+                break
+            old_events.append((event_date.toordinal(), bool(completed_date)))
+            last_event_id = event_id
+        if old_events:
+            append_archive(storage.archive_dir, habit_name, old_events, last_event_id)
+            last_archived = last_event_id
+            archived += len(old_events)
+
+        if last_archived:
+            c.execute("DELETE FROM dates WHERE habit_name = ? AND event_id <= ?", (habit_name, last_archived))
+            db.commit()
+
+    db.close()
+    return archived
+
+
+if __name__ == '__main__':
+    # python archive.py [DATABASE] archives the old events of the database (HabitTracker.db by default)
+    import database
+
+    habit_storage = database.SQLiteStorage(*sys.argv[1:2])
+    habit_storage.create_table()
+    print(f"Archived {archive_events(habit_storage)} events.")
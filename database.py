@@ -1,284 +1,870 @@
+import hashlib
 import json
+import os
 import sqlite3
-from datetime import datetime, timedelta
+import struct
+import time
+import zlib
 
+import archive
 from habits import Habit
+from storage import Storage, TEST_EVENTS, TEST_HABITS, HabitExistsError, apply_event, count_transitions, parse_date, \
+    record_lock_wait
 
+DATABASE = 'HabitTracker.db'
 
-def create_table():
+# columns of the rows that changes_since hands to replicas
+HABIT_COLUMNS = ("habit_name", "habit_date", "periodicity", "task_specification", "current_streak", "longest_streak",
+                 "broken_streak", "completed_date", "not_completed_date", "last_update", "calendar", "snapshot_event",
+                 "version", "transitions", "snapshot_outcome")
+DATE_COLUMNS = ("event_id", "habit_name", "completed_date", "not_completed_date", "last_update")
+
+# The habits table stores the periodicity as one of these small integers and the task specification as the id of a
+# row in task_specs, where every distinct specification is stored once. Specifications longer than COMPRESS_MIN_LENGTH
+# bytes are stored zlib-compressed.
+PERIODICITIES = {'daily': 1, 'weekly': 2, 'monthly': 3}
+PERIODICITY_NAMES = {code: name for name, code in PERIODICITIES.items()}
+COMPRESS_MIN_LENGTH = 64
+
+# the columns of HABIT_COLUMNS as they are stored in the habits table
+STORED_HABIT_COLUMNS = tuple('spec_id' if column == 'task_specification' else column for column in HABIT_COLUMNS)
+
+# number of log events of a habit after which append_event folds them into the habit's snapshot
+SNAPSHOT_INTERVAL = 50
+
+# version of the database layout, stored in PRAGMA user_version. create_table only touches the schema of a database
+# file with an older version.
+SCHEMA_VERSION = 6
+
+# the transition counts of a habit are stored as four little-endian unsigned 32-bit integers
+TRANSITIONS = struct.Struct('<4I')
+
+# Queries that read or change a whole table on purpose end with the comment /* whole table */, so that the query plan
+# audit (query_plan.py) accepts a scan of the table for them.
+
+# seconds a connection waits for another process to release its lock before failing with "database is locked"
+BUSY_TIMEOUT = 5.0
+
+
+def enable_wal(c):
     """
-    Creates tables for habits and dates if they don't exist already. The data is stored in two separate tables for
-    efficiency, given that one big table would have too many values and be complicated to manage because of dates.
+    Switches the database to WAL mode. The switch needs the database file to itself and SQLite fails right away
+    instead of waiting for the other connections, so it is retried until BUSY_TIMEOUT has passed.
     """
-    db = sqlite3.connect('HabitTracker.db')
-    c = db.cursor()
-    c.execute("""DROP TABLE IF EXISTS habits""")
-    c.execute("""DROP TABLE IF EXISTS dates""")
-    c.execute("""CREATE TABLE IF NOT EXISTS habits (
-            habit_name TEXT NOT NULL PRIMARY KEY,
-            habit_date TEXT NOT NULL,
-            periodicity TEXT,
-            task_specification TEXT,
-            current_streak INTEGER,
-            longest_streak INTEGER,
-            broken_streak INTEGER
-            )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS dates (
-                    habit_name TEXT NOT NULL,
-                    completed_date text array TEXT,
-                    not_completed_date text array TEXT,
-                    last_update TEXT,
-                    FOREIGN KEY (habit_name) REFERENCES habits(habit_name)
-                    )""")
-    db.commit()
-    db.close()
-
-
-def update_habits():
-    """
-    Updates habits. If the habit is not marked completed (checked off) in its respective period (day, week, or month),
-    the habit streak is broken, current streak is set to 0 and the date is stored as the day when a habit was not done.
-    """
-    today = datetime.now()
-
-    for habit in view_all_info():
-        if habit.periodicity == 'daily':
-            period = timedelta(days=1)
-        elif habit.periodicity == 'weekly':
-            period = timedelta(weeks=1)
-        elif habit.periodicity == 'monthly':
-            period = timedelta(days=30)
-
-        # Check if last completed date is beyond the period
-        if habit.last_update is not None:
-            last_update = datetime.strptime(habit.last_update, "%d.%m.%Y")
-            if today - last_update > period:
-                habit.current_streak = 0
-                habit.broken_streak += 1
-                habit.not_completed_date = today.strftime("%d.%m.%Y")
-        else:
-            # if a habit is new, the last_update is set to None. In this case, not completed habit periods are counted
-            # from the habit creation date.
-            last_update = datetime.strptime(habit.habit_date, "%d.%m.%Y")
-            if today - last_update > period:
-                habit.current_streak = 0
-                habit.broken_streak += 1
-                habit.not_completed_date = today.strftime("%d.%m.%Y")
-
-        db = sqlite3.connect('HabitTracker.db')
-        c = db.cursor()
+    deadline = time.monotonic() + BUSY_TIMEOUT
+    while True:
+        try:
+            c.execute("PRAGMA journal_mode = WAL")
+            return
+        except sqlite3.OperationalError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+def begin_write(c):
+    """
+    Starts a write transaction right away instead of at the first write, so that the time spent waiting for the write
+    lock of other connections is measured in one place and recorded as lock-wait time.
+    """
+    start = time.perf_counter()
+    c.execute("BEGIN IMMEDIATE")
+    record_lock_wait(start)
 
-        c.execute("""UPDATE habits SET current_streak = ?, broken_streak = ? WHERE habit_name = ?""",
-                  (habit.current_streak, habit.broken_streak, habit.habit_name))
 
-        not_completed_date_str = json.dumps(habit.not_completed_date)
+def load_habits(c, habit_name=None, specs=None):
+    """
+    Rebuilds the current state of all habits (or only of the given one) from their latest snapshot and the events
+    logged after it. The id of the last applied event is kept in habit.snapshot_event and the version of the habit
+    in habit.version. The streaks are stored up to date (see append_event), so they are taken from the habits table.
 
-        c.execute("""UPDATE dates SET not_completed_date = ? WHERE habit_name = ?""",
-                  (not_completed_date_str, habit.habit_name))
+    The task specifications are only decoded if a dict for the decoded specifications is given (see
+    task_specifications), otherwise habit.task_specification is None and only habit.spec_id is set.
+    """
+    query = """SELECT habit_name, habit_date, periodicity, spec_id, current_streak, longest_streak,
+            broken_streak, completed_date, not_completed_date, last_update, calendar, snapshot_event, version,
+            transitions, snapshot_outcome FROM habits"""
+    if habit_name is None:
+        c.execute(query + " /* whole table */")
+    else:
+        c.execute(query + " WHERE habit_name = ?", (habit_name,))
+    habits_data = c.fetchall()
+    if specs is not None:
+        task_specifications(c, [habit_data[3] for habit_data in habits_data], specs)
 
-        db.commit()
-        db.close()
+    habits = []
+    for habit_data in habits_data:
+        habit = Habit(*habit_data[:10])  # Create an instance of Habit class using tuple unpacking
+        habit.periodicity = PERIODICITY_NAMES.get(habit_data[2])
+        habit.spec_id = habit_data[3]
+        habit.task_specification = specs.get(habit.spec_id) if specs is not None else None
+        habit.calendar = int.from_bytes(habit_data[10] or b'', 'little')
+        habit.snapshot_event = habit_data[11]
+        habit.version = habit_data[12]
+        if habit_data[13] is not None:
+            habit.transitions = TRANSITIONS.unpack(habit_data[13])
+
+        # The replay only needs the outcome of the last period of the snapshot, which record_outcome reads from the
+        # streaks, and the streaks themselves are restored afterwards.
+        streaks = habit.current_streak, habit.longest_streak, habit.broken_streak
+        habit.current_streak, habit.broken_streak = {1: (1, 0), 0: (0, 1)}.get(habit_data[14], (0, 0))
+        c.execute("""SELECT event_id, completed_date, not_completed_date, last_update FROM dates
+                    WHERE habit_name = ? AND event_id > ? ORDER BY event_id""",
+                  (habit.habit_name, habit.snapshot_event))
+        for event_id, completed_date, not_completed_date, last_update in c.fetchall():
+            apply_event(habit, completed_date, not_completed_date, last_update)
+            habit.snapshot_event = event_id
+        habit.snapshot_outcome = 1 if habit.current_streak else 0 if habit.broken_streak else None
+        habit.current_streak, habit.longest_streak, habit.broken_streak = streaks
+        habits.append(habit)
+    return habits
+
+
+def store_task_specification(c, task_specification):
+    """
+    Returns the id of the task_specs row of the task specification, which is added if no habit uses the same
+    specification yet.
+    """
+    if task_specification is None:
+        return None
+    data = task_specification.encode()
+    digest = hashlib.sha1(data).digest()
+    # fetchall ends the read, so that a following write doesn't have to upgrade an outdated read transaction
+    c.execute("SELECT spec_id FROM task_specs WHERE digest = ?", (digest,))
+    spec = c.fetchall()
+    if spec:
+        return spec[0][0]
+
+    compressed = len(data) > COMPRESS_MIN_LENGTH and len(zlib.compress(data)) < len(data)
+    # another writer may have added the same specification in the meantime
+    c.execute("INSERT OR IGNORE INTO task_specs (digest, compressed, data) VALUES (?, ?, ?)",
+              (digest, compressed, zlib.compress(data) if compressed else data))
+    c.execute("SELECT spec_id FROM task_specs WHERE digest = ?", (digest,))
+    return c.fetchall()[0][0]
+
+
+def task_specifications(c, spec_ids, specs):
+    """
+    Decodes the task specifications with the given ids that are not in the dict specs yet and adds them to it. A
+    specification row never changes, so every specification is only read and decompressed once per dict.
+    """
+    missing = list({spec_id for spec_id in spec_ids if spec_id is not None and spec_id not in specs})
+    # the number of parameters of one query is limited, so the ids are read in chunks
+    for start in range(0, len(missing), 500):
+        chunk = missing[start:start + 500]
+        c.execute(f"SELECT spec_id, compressed, data FROM task_specs WHERE spec_id IN ({', '.join('?' * len(chunk))})",
+                  chunk)
+        for spec_id, compressed, data in c.fetchall():
+            specs[spec_id] = (zlib.decompress(data) if compressed else data).decode()
 
 
-def check_habit_off(current_streak, longest_streak, broken_streak, completed_date,
-                    not_completed_date, last_update, habit_name):
+def delete_unused_task_specification(c, spec_id):
     """
-    This method checks off a habit and updates the databases.
+    Deletes the task specification if no habit uses it anymore.
     """
-    db = sqlite3.connect('HabitTracker.db')
-    c = db.cursor()
-    c.execute("""UPDATE habits SET current_streak = ?, longest_streak = ?, broken_streak = ? 
-                WHERE habit_name = ?""",
-              (current_streak, longest_streak, broken_streak, habit_name))
+    c.execute("DELETE FROM task_specs WHERE spec_id = ? AND NOT EXISTS (SELECT 1 FROM habits WHERE spec_id = ?)",
+              (spec_id, spec_id))
 
-    completed_date_str = json.dumps(completed_date)
-    not_completed_date_str = json.dumps(not_completed_date)
 
-    c.execute("""UPDATE dates SET completed_date = ?, not_completed_date = ?, last_update = ?
-                WHERE habit_name = ?""", (completed_date_str, not_completed_date_str, last_update, habit_name))
-    db.commit()
-    db.close()
+def write_snapshot(c, habit):
+    """
+    Stores the rebuilt state of the habit as its new snapshot. A snapshot never replaces a newer one. The streaks are
+    not part of the snapshot, append_event keeps them up to date.
+    """
+    c.execute("""UPDATE habits SET completed_date = ?, not_completed_date = ?, last_update = ?, calendar = ?,
+                snapshot_event = ?, transitions = ?, snapshot_outcome = ?
+                WHERE habit_name = ? AND snapshot_event < ?""",
+              (habit.completed_date or None, habit.not_completed_date or None, habit.last_update,
+               calendar_blob(habit.calendar), habit.snapshot_event, TRANSITIONS.pack(*habit.transitions),
+               habit.snapshot_outcome, habit.habit_name, habit.snapshot_event))
 
 
-def add_habit(habit):
+def calendar_blob(calendar):
     """
-    This method adds a habit with its respective values to the database.
+    Converts a completion calendar into the bytes stored in the database, the first period being the lowest bit.
     """
-    db = sqlite3.connect('HabitTracker.db')
-    c = db.cursor()
-    c.execute("""INSERT INTO habits VALUES (?, ?, ?, ?, ?, ?, ?)""",
-              (habit.habit_name, habit.habit_date, habit.periodicity,
-               habit.task_specification, habit.current_streak, habit.longest_streak,
-               habit.broken_streak))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              (habit.habit_name, habit.completed_date, habit.not_completed_date,
-               habit.last_update))
-    db.commit()
-    db.close()
+    return calendar.to_bytes((calendar.bit_length() + 7) // 8, 'little')
 
 
-def delete_habit(habit_name):
+def create_change_feed(c):
     """
-    Deletes a habit with its respective values from the database.
+    Creates the change feed (layout version 2): the changes table gets a new, increasing sequence number for every
+    changed row. A habit is only listed with its latest change, so a replica that catches up copies every changed
+    habit once. Events are never updated, so only new ones are listed. Events deleted with their habit are covered
+    by the deletion of the habit, and events moved into the archive stay on the replicas.
+
+    The sync_state table keeps the sequence number up to which the changes of each source database were applied
+    to this one (see sync.py). Existing habits and events are added to the feed, so that a new replica receives
+    them as well.
     """
-    db = sqlite3.connect('HabitTracker.db')
-    c = db.cursor()
-    c.execute("""DELETE FROM habits WHERE habit_name = ?""", (habit_name,))
-    c.execute("""DELETE FROM dates WHERE habit_name = ?""", (habit_name,))
-    db.commit()
-    db.close()
+    c.execute("""CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_key NOT NULL,
+            deleted INTEGER NOT NULL DEFAULT 0
+            )""")
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_changes_row ON changes (table_name, row_key, deleted)""")
+    create_sync_state(c)
+    create_change_triggers(c)
+    c.execute("""INSERT INTO changes (table_name, row_key) SELECT 'habits', habit_name FROM habits /* whole table */""")
+    c.execute("""INSERT INTO changes (table_name, row_key) SELECT 'dates', event_id FROM dates ORDER BY event_id
+                /* whole table */""")
 
 
-def view_all_habits():
+def create_sync_state(c):
     """
-    Retrieves a list of all habit names.
+    Creates the sync_state table (layout version 6), which numbers the source databases. Events copied from a source
+    keep its number and their id in the source in the origin and origin_event_id columns of the dates table, and get
+    an id of this database like any other event.
     """
-    db = sqlite3.connect('HabitTracker.db')
-    c = db.cursor()
-    c.execute("SELECT habit_name FROM habits")
-    habits = c.fetchall()
-    return [habit[0] for habit in habits]
+    c.execute("""CREATE TABLE IF NOT EXISTS sync_state (
+            origin INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT NOT NULL UNIQUE,
+            seq INTEGER NOT NULL
+            )""")
 
 
-def view_all_info():
+def migrate_sync_state(c):
+    """
+    Numbers the source databases of layout versions 2 to 5, whose replicated events kept their id in the source and
+    would collide with the events logged in the replica. If the database has a single source, all of its events are
+    marked as copies of the source's events with the same id, which is how they were copied.
+    """
+    c.execute("""ALTER TABLE sync_state RENAME TO legacy_sync_state""")
+    create_sync_state(c)
+    c.execute("""INSERT INTO sync_state (source, seq) SELECT source, seq FROM legacy_sync_state ORDER BY source
+                /* whole table */""")
+    c.execute("""DROP TABLE legacy_sync_state""")
+    c.execute("SELECT origin FROM sync_state /* whole table */")
+    origins = c.fetchall()
+    if len(origins) == 1:
+        c.execute("UPDATE dates SET origin = ?, origin_event_id = event_id /* whole table */", origins[0])
+
+
+def create_change_triggers(c):
     """
-    Retrieves all habit information.
+    Creates the triggers that add the changes of the habits and dates tables to the change feed.
     """
-    db = sqlite3.connect('HabitTracker.db')
-    c = db.cursor()
-    c.execute("SELECT * FROM habits")
+    # A habit that was deleted and added again keeps its deletion in the feed, so that replicas drop the events of
+    # the deleted habit before they receive the new one.
+    for trigger, event, row, deleted in (("habits_insert_change", "INSERT", "NEW", 0),
+                                         ("habits_update_change", "UPDATE", "NEW", 0),
+                                         ("habits_delete_change", "DELETE", "OLD", 1)):
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS {trigger} AFTER {event} ON habits BEGIN
+                DELETE FROM changes WHERE table_name = 'habits' AND row_key = {row}.habit_name
+                AND deleted <= {deleted};
+                INSERT INTO changes (table_name, row_key, deleted) VALUES ('habits', {row}.habit_name, {deleted});
+                END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS dates_insert_change AFTER INSERT ON dates BEGIN
+            INSERT INTO changes (table_name, row_key) VALUES ('dates', NEW.event_id);
+            END""")
+
+
+def migrate_task_specifications(c):
+    """
+    Converts the habits table of layout version 1 or 2, which stores the periodicity and the task specification as
+    text, into layout version 3. SQLite can't change the type of a column, so the table is copied into a new one.
+    """
+    c.execute("""SELECT habit_name, habit_date, periodicity, task_specification, current_streak, longest_streak,
+                broken_streak, completed_date, not_completed_date, last_update, calendar, snapshot_event, version
+                FROM habits /* whole table */""")
     habits_data = c.fetchall()
+    c.execute("""DROP TABLE habits""")
+    create_habits_table(c)
+    c.executemany("""INSERT INTO habits (habit_name, habit_date, periodicity, spec_id, current_streak, longest_streak,
+                    broken_streak, completed_date, not_completed_date, last_update, calendar, snapshot_event, version)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                  [(habit_data[0], habit_data[1], PERIODICITIES.get(habit_data[2]),
+                    store_task_specification(c, habit_data[3]), *habit_data[4:]) for habit_data in habits_data])
 
-    habits = []
-    for habit_data in habits_data:
-        habit = Habit(*habit_data)  # Create an instance of Habit class using tuple unpacking
-        habit_name = habit_data[0]
-        c.execute("SELECT completed_date, not_completed_date, last_update FROM dates WHERE habit_name = ?",
-                  (habit_name,))
-        dates = c.fetchone()
-        if dates:
-            completed_date = json.dumps(dates[0]) if dates[0] else "[]"
-            not_completed_date = json.dumps(dates[1]) if dates[1] else "[]"
-            last_update = (dates[2]) if dates[2] else None
-            habit.completed_date = completed_date
-            habit.not_completed_date = not_completed_date
-            habit.last_update = last_update
-        habits.append(habit)
 
-    db.close()
-    return habits
+def migrate_transitions(c, archive_dir):
+    """
+    Counts the transitions of the habits of layout versions 1 to 3, which have no transitions column yet, from their
+    archived events and the events of their snapshot.
+    """
+    c.execute("SELECT habit_name, snapshot_event FROM habits /* whole table */")
+    for habit_name, snapshot_event in c.fetchall():
+        segments, last_archived = archive.read_archive(archive_dir, habit_name)
+        outcomes = [bool(bitmap[i >> 3] >> (i & 7) & 1) for ordinals, bitmap in segments for i in range(len(ordinals))]
+        c.execute("""SELECT completed_date FROM dates WHERE habit_name = ? AND event_id > ? AND event_id <= ?
+                    ORDER BY event_id""", (habit_name, last_archived, snapshot_event))
+        outcomes.extend(bool(event[0]) for event in c.fetchall())
+        c.execute("UPDATE habits SET transitions = ? WHERE habit_name = ?",
+                  (TRANSITIONS.pack(*count_transitions(outcomes)), habit_name))
+
+
+def migrate_live_streaks(c):
+    """
+    Converts the streaks of layout versions 1 to 4, which belong to the snapshot, into the current streaks of layout
+    version 5 and keeps the outcome of the last period of the snapshot in snapshot_outcome.
+    """
+    c.execute("""SELECT habit_name, current_streak, longest_streak, broken_streak, snapshot_event FROM habits
+                /* whole table */""")
+    for habit_name, current_streak, longest_streak, broken_streak, snapshot_event in c.fetchall():
+        current_streak, longest_streak, broken_streak = current_streak or 0, longest_streak or 0, broken_streak or 0
+        snapshot_outcome = 1 if current_streak else 0 if broken_streak else None
+        c.execute("""SELECT completed_date FROM dates WHERE habit_name = ? AND event_id > ? ORDER BY event_id""",
+                  (habit_name, snapshot_event))
+        for event in c.fetchall():
+            if event[0]:
+                current_streak, broken_streak = current_streak + 1, 0
+                longest_streak = max(longest_streak, current_streak)
+            else:
+                current_streak, broken_streak = 0, broken_streak + 1
+        c.execute("""UPDATE habits SET current_streak = ?, longest_streak = ?, broken_streak = ?, snapshot_outcome = ?
+                    WHERE habit_name = ?""",
+                  (current_streak, longest_streak, broken_streak, snapshot_outcome, habit_name))
+
+
+def legacy_date(value):
+    """
+    Returns a date of a database without a layout version. The app of that time JSON-encoded a date again every time
+    it rewrote it ('"01.02.2024"', '"\\"01.02.2024\\""', ...) and stored an empty list ('[]') for new habits.
+    """
+    while value is not None and value.startswith(('"', 'null', '[')):
+        value = json.loads(value)
+        if isinstance(value, list):
+            value = value[-1] if value else None
+        if not isinstance(value, str):
+            return None
+    return value
 
 
-def add_test_data():
-    """
-    Adds test data for a period of 4 weeks to the database.
-    """
-    db = sqlite3.connect('HabitTracker.db')
-    c = db.cursor()
-
-    c.execute("""INSERT INTO habits VALUES (?, ?, ?, ?, ?, ?, ?)""",
-              ("clean", "24.01.2024", "weekly", "Clean the apartment",
-               5, 5, 0))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("clean", "24.01.2024", None, "24.01.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("clean", "31.01.2024", None, "31.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("clean", "07.02.2024", None, "07.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("clean", "14.02.2024", None, "14.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("clean", "21.02.2024", None, "21.02.2024"))
-
-    c.execute("""INSERT INTO habits VALUES (?, ?, ?, ?, ?, ?, ?)""",
-              ("finance", "21.01.2024", "monthly", "Review and plan your expenses",
-               2, 2, 0))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("finance", "21.01.2024", None, "21.01.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("finance", "22.02.2024", None, "22.02.2024"))
-
-    c.execute("""INSERT INTO habits VALUES (?, ?, ?, ?, ?, ?, ?)""",
-              ("goals", "26.01.2024", "monthly", "Write down your current goals",
-               1, 1, 0))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("goals", "26.01.2024", None, "26.01.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("goals", "26.02.2024", None, "26.02.2024"))
-
-    c.execute("""INSERT INTO habits VALUES (?, ?, ?, ?, ?, ?, ?)""",
-              ("no phone", "24.01.2024", "weekly", "Do not use the phone for the entire day",
-               0, 1, 4))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("no phone", "25.01.2024", None, "25.01.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("no phone", None, "01.02.2024", "25.01.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("no phone", None, "08.02.2024", "25.01.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("no phone", None, "15.02.2024", "25.01.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("no phone", None, "22.02.2024", "25.01.2024"))
-
-    c.execute("""INSERT INTO habits VALUES (?, ?, ?, ?, ?, ?, ?)""",
-              ("read", "28.01.2024", "daily", "Read at least 30 minutes per day",
-               0, 15, 9))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", None, "28.01.2024", "28.01.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", None, "29.01.2024", "28.01.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", "30.01.2024", None, "30.01.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", None, "31.01.2024", "30.01.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", "01.02.2024", None, "01.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", "02.02.2024", None, "02.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", "03.02.2024", None, "03.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", "04.02.2024", None, "04.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", "05.02.2024", None, "05.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", "06.02.2024", None, "06.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", "07.02.2024", None, "07.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", "08.02.2024", None, "08.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", "09.02.2024", None, "09.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", "10.02.2024", None, "10.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", "11.02.2024", None, "11.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", "12.02.2024", None, "12.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", "13.02.2024", None, "13.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", "14.02.2024", None, "14.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", "15.02.2024", None, "15.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", None, "16.02.2024", "15.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", None, "18.02.2024", "15.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", None, "19.02.2024", "15.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", None, "20.02.2024", "15.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", None, "21.02.2024", "15.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", None, "22.02.2024", "15.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", None, "23.02.2024", "15.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", None, "24.02.2024", "15.02.2024"))
-    c.execute("""INSERT INTO dates VALUES (?, ?, ?, ?)""",
-              ("read", None, "25.02.2024", "15.02.2024"))
-
-    db.commit()
-    db.close()
+def convert_legacy_tables(c, tables):
+    """
+    Converts the tables of a database without a layout version, which were renamed to legacy_habits and legacy_dates,
+    into the current layout. The stored streaks are kept.
+
+    The app of that time added a dates row per period, but overwrote the dates of all rows of a habit whenever it
+    checked the habit off or logged a missed period, so the same date is repeated over many rows. Every distinct
+    completed and missed date of a habit becomes one event, in the order of the dates; on the same day the missed
+    period comes first, as the roll-over ran before the check-off.
+    """
+    habits_data = []
+    events = []
+    if 'habits' in tables:
+        c.execute("""SELECT habit_name, habit_date, periodicity, task_specification, current_streak, longest_streak,
+                    broken_streak FROM legacy_habits /* whole table */""")
+        habits_data = c.fetchall()
+    if 'dates' in tables:
+        habit_names = {habit_data[0] for habit_data in habits_data}
+        c.execute("""SELECT habit_name, completed_date, not_completed_date, last_update FROM legacy_dates ORDER BY rowid
+                    /* whole table */""")
+        # the last update of the first row with the date, by (habit_name, date, completed)
+        dates = {}
+        for habit_name, completed_date, not_completed_date, last_update in c.fetchall():
+            if habit_name not in habit_names:
+                continue
+            for date, completed in (legacy_date(completed_date), True), (legacy_date(not_completed_date), False):
+                if date:
+                    dates.setdefault((habit_name, date, completed), last_update)
+        for (habit_name, date, completed), last_update in sorted(
+                dates.items(), key=lambda item: (item[0][0], parse_date(item[0][1]), item[0][2])):
+            events.append((habit_name, date if completed else None, None if completed else date, last_update))
+    insert_habits(c, habits_data, events)
+    for table in tables:
+        c.execute(f"DROP TABLE legacy_{table}")
+
+
+def insert_habits(c, habits_data, events):
+    """
+    Adds habits given as (habit_name, habit_date, periodicity, task_specification, current_streak, longest_streak,
+    broken_streak), whose streaks already include all of their events, together with their events given as
+    (habit_name, completed_date, not_completed_date, last_update) in log order.
+    """
+    c.executemany("""INSERT INTO habits (habit_name, habit_date, periodicity, spec_id, current_streak, longest_streak,
+                    broken_streak) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                  [(habit_name, habit_date, PERIODICITIES.get(periodicity), store_task_specification(c, specification),
+                    *streaks) for habit_name, habit_date, periodicity, specification, *streaks in habits_data])
+    c.executemany("""INSERT INTO dates (habit_name, completed_date, not_completed_date, last_update)
+                    VALUES (?, ?, ?, ?)""", events)
+
+    # The streaks already include all events, so the snapshots start after the last event.
+    c.execute("""UPDATE habits SET
+                completed_date = (SELECT completed_date FROM dates WHERE dates.habit_name = habits.habit_name
+                                  AND completed_date IS NOT NULL ORDER BY event_id DESC LIMIT 1),
+                not_completed_date = (SELECT not_completed_date FROM dates
+                                      WHERE dates.habit_name = habits.habit_name
+                                      AND not_completed_date IS NOT NULL ORDER BY event_id DESC LIMIT 1),
+                last_update = (SELECT last_update FROM dates WHERE dates.habit_name = habits.habit_name
+                               ORDER BY event_id DESC LIMIT 1),
+                snapshot_event = COALESCE((SELECT MAX(event_id) FROM dates WHERE dates.habit_name = habits.habit_name),
+                                          0),
+                snapshot_outcome = (SELECT completed_date IS NOT NULL FROM dates
+                                    WHERE dates.habit_name = habits.habit_name ORDER BY event_id DESC LIMIT 1)
+                /* whole table */""")
+
+    # the calendars and the transitions are built from the events
+    outcomes = {}
+    completed_dates = {}
+    for habit_name, completed_date, not_completed_date, last_update in events:
+        outcomes.setdefault(habit_name, []).append(bool(completed_date))
+        if completed_date:
+            completed_dates.setdefault(habit_name, []).append(parse_date(completed_date).date())
+    for habit in load_habits(c):
+        for completed_date in completed_dates.get(habit.habit_name, []):
+            habit.mark_completed(completed_date)
+        transitions = count_transitions(outcomes.get(habit.habit_name, []))
+        c.execute("UPDATE habits SET calendar = ?, transitions = ? WHERE habit_name = ?",
+                  (calendar_blob(habit.calendar), TRANSITIONS.pack(*transitions), habit.habit_name))
+
+
+def create_habits_table(c):
+    """
+    Creates the habits table (layout version 5).
+    """
+    c.execute("""CREATE TABLE IF NOT EXISTS habits (
+            habit_name TEXT NOT NULL PRIMARY KEY,
+            habit_date TEXT NOT NULL,
+            periodicity INTEGER,
+            spec_id INTEGER,
+            current_streak INTEGER,
+            longest_streak INTEGER,
+            broken_streak INTEGER,
+            completed_date TEXT,
+            not_completed_date TEXT,
+            last_update TEXT,
+            calendar BLOB,
+            snapshot_event INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0,
+            transitions BLOB,
+            snapshot_outcome INTEGER,
+            FOREIGN KEY (spec_id) REFERENCES task_specs(spec_id)
+            )""")
+
+
+class SQLiteStorage(Storage):
+    """
+    Stores the habits in an SQLite database file. Events older than the archive horizon are kept in the archive
+    directory next to the database file (see archive.py).
+    """
+
+    def __init__(self, path=DATABASE):
+        self.path = str(path)
+        self.archive_dir = os.path.join(os.path.dirname(self.path), archive.ARCHIVE_DIR)
+        # the decoded task specifications by their id in task_specs
+        self.specs = {}
+
+    def connect(self):
+        """
+        Opens a connection to the database that waits for locks of other processes instead of failing immediately.
+        """
+        return sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+
+    def create_table(self):
+        """
+        Creates tables for habits and dates if they don't exist already. The data is stored in two separate tables for
+        efficiency, given that one big table would have too many values and be complicated to manage because of dates.
+
+        The dates table is an append-only log: every completed or missed period adds a new event and events are never
+        updated. The dates, completion calendar and transition counts stored in the habits table are a snapshot of
+        the habit state up to the event snapshot_event, and the current state is the snapshot plus all later events of
+        the log. The streaks are updated together with every event, so they can be queried without replaying the log.
+
+        Every event of a habit increases its version. Writers only append an event if the version is still the one
+        they read (compare-and-swap), so processes sharing the database never act on an outdated habit state. The
+        database runs in WAL mode, so that readers and the writer don't block each other.
+
+        Periodicities are stored as small integers (PERIODICITIES) and task specifications in the task_specs table,
+        where each distinct specification is stored once and long ones are compressed.
+
+        The layout version is stored in the database file, so a database that is already up to date is only opened
+        and closed again and its data is kept.
+        """
+        db = self.connect()
+        c = db.cursor()
+        c.execute("PRAGMA user_version")
+        schema_version = c.fetchone()[0]
+        if schema_version == SCHEMA_VERSION:
+            db.close()
+            return
+
+        enable_wal(c)
+        # The layout is changed in one transaction, so an interrupted migration leaves the database as it was. The
+        # transaction takes the write lock right away and the version is read again, because another process may have
+        # changed the layout in the meantime.
+        begin_write(c)
+        c.execute("PRAGMA user_version")
+        schema_version = c.fetchone()[0]
+        if schema_version == SCHEMA_VERSION:
+            db.close()
+            return
+        legacy_tables = []
+        if schema_version == 0:
+            # Databases without a version were written before the event log. Their tables are converted below.
+            c.execute("""SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('habits', 'dates')
+                        /* whole table */""")
+            legacy_tables = [table[0] for table in c.fetchall()]
+            for table in legacy_tables:
+                c.execute(f"ALTER TABLE {table} RENAME TO legacy_{table}")
+        c.execute("""CREATE TABLE IF NOT EXISTS task_specs (
+                spec_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                digest BLOB NOT NULL UNIQUE,
+                compressed INTEGER NOT NULL,
+                data BLOB NOT NULL
+                )""")
+        if 0 < schema_version < 3:
+            migrate_task_specifications(c)
+        elif schema_version == 3:
+            c.execute("""ALTER TABLE habits ADD COLUMN transitions BLOB""")
+        if 3 <= schema_version < 5:
+            c.execute("""ALTER TABLE habits ADD COLUMN snapshot_outcome INTEGER""")
+        create_habits_table(c)
+        if 0 < schema_version < 4:
+            migrate_transitions(c, self.archive_dir)
+        c.execute("""CREATE TABLE IF NOT EXISTS dates (
+                        event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        habit_name TEXT NOT NULL,
+                        completed_date text array TEXT,
+                        not_completed_date text array TEXT,
+                        last_update TEXT,
+                        origin INTEGER,
+                        origin_event_id INTEGER,
+                        FOREIGN KEY (habit_name) REFERENCES habits(habit_name)
+                        )""")
+        if 0 < schema_version < 6:
+            c.execute("""ALTER TABLE dates ADD COLUMN origin INTEGER""")
+            c.execute("""ALTER TABLE dates ADD COLUMN origin_event_id INTEGER""")
+
+        # Habits are looked up by name through the primary key index. The indexes below cover the remaining access
+        # patterns: events of one habit in log order (they also hold every selected column, so the rows are never
+        # visited), habits of one periodicity, and habits ordered by their longest or broken streak.
+        if 0 < schema_version < 5:
+            migrate_live_streaks(c)
+        if legacy_tables:
+            convert_legacy_tables(c, legacy_tables)
+
+        c.execute("""CREATE INDEX IF NOT EXISTS idx_dates_habit
+                    ON dates (habit_name, event_id, completed_date, not_completed_date, last_update)""")
+        c.execute("""CREATE INDEX IF NOT EXISTS idx_habits_periodicity ON habits (periodicity, habit_name)""")
+        c.execute("""CREATE INDEX IF NOT EXISTS idx_habits_longest_streak ON habits (longest_streak, habit_name)""")
+        c.execute("""CREATE INDEX IF NOT EXISTS idx_habits_broken_streak ON habits (broken_streak, habit_name)""")
+        c.execute("""CREATE INDEX IF NOT EXISTS idx_habits_spec ON habits (spec_id)""")
+
+        # replicated events are found by their source and their id in the source
+        c.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_dates_origin
+                    ON dates (origin, habit_name, origin_event_id)""")
+
+        if schema_version < 2:
+            create_change_feed(c)
+        elif schema_version < 6:
+            migrate_sync_state(c)
+        # the triggers are dropped with the habits table of older layouts
+        create_change_triggers(c)
+        c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        db.commit()
+        db.close()
+
+    def clear(self):
+        """
+        Deletes all habits, their events and their archive files.
+        """
+        db = self.connect()
+        c = db.cursor()
+        c.execute("""DELETE FROM dates /* whole table */""")
+        c.execute("""DELETE FROM habits /* whole table */""")
+        c.execute("""DELETE FROM task_specs /* whole table */""")
+        db.commit()
+        db.close()
+
+        archive.clear_archive(self.archive_dir)
+        self.specs = {}
+        self.rolled_over_on = None
+
+    def append_event(self, habit_name, version, completed_date, not_completed_date, last_update):
+        """
+        Appends an event to the log and increases the version of the habit, but only if the habit is still at the
+        given version. The streaks of the habit are updated in the same statement. Once enough events have been logged
+        since the last snapshot, they are folded into the habit's snapshot.
+        """
+        db = self.connect()
+        c = db.cursor()
+        begin_write(c)
+        # the values on the right side are those before the update
+        completed = completed_date is not None
+        c.execute("""UPDATE habits SET version = version + 1,
+                    current_streak = CASE WHEN ? THEN current_streak + 1 ELSE 0 END,
+                    longest_streak = CASE WHEN ? THEN MAX(longest_streak, current_streak + 1) ELSE longest_streak END,
+                    broken_streak = CASE WHEN ? THEN 0 ELSE broken_streak + 1 END
+                    WHERE habit_name = ? AND version = ?""", (completed, completed, completed, habit_name, version))
+        if c.rowcount == 0:
+            db.close()
+            return False
+        c.execute("""INSERT INTO dates (habit_name, completed_date, not_completed_date, last_update)
+                    VALUES (?, ?, ?, ?)""", (habit_name, completed_date, not_completed_date, last_update))
+
+        c.execute("""SELECT COUNT(*) FROM dates WHERE habit_name = ?
+                    AND event_id > (SELECT snapshot_event FROM habits WHERE habit_name = ?)""",
+                  (habit_name, habit_name))
+        if c.fetchone()[0] >= SNAPSHOT_INTERVAL:
+            for habit in load_habits(c, habit_name):
+                write_snapshot(c, habit)
+        db.commit()
+        db.close()
+        return True
+
+    def compact_log(self):
+        """
+        Folds the events logged since the last snapshot of every habit into a new snapshot, so that loading the habits
+        only has to replay the events logged afterwards. The events themselves stay in the log for the statistics.
+        """
+        db = self.connect()
+        c = db.cursor()
+        for habit in load_habits(c):
+            write_snapshot(c, habit)
+        db.commit()
+        db.close()
+
+    def add_habit(self, habit):
+        """
+        This method adds a habit with its respective values to the database.
+        """
+        db = self.connect()
+        c = db.cursor()
+        begin_write(c)
+        c.execute("""INSERT OR IGNORE INTO habits (habit_name, habit_date, periodicity, spec_id, current_streak,
+                    longest_streak, broken_streak, last_update) VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                  (habit.habit_name, habit.habit_date, PERIODICITIES.get(habit.periodicity),
+                   store_task_specification(c, habit.task_specification), habit.current_streak, habit.longest_streak,
+                   habit.broken_streak, habit.last_update))
+        if c.rowcount == 0:
+            # the task specification that was stored for the habit is rolled back with it
+            db.close()
+            raise HabitExistsError(f"A habit with the name {habit.habit_name} exists already.")
+        db.commit()
+        db.close()
+
+    def delete_habit(self, habit_name):
+        """
+        Deletes a habit with its respective values from the database.
+        """
+        db = self.connect()
+        c = db.cursor()
+        begin_write(c)
+        c.execute("""SELECT spec_id FROM habits WHERE habit_name = ?""", (habit_name,))
+        habits = c.fetchall()
+        c.execute("""DELETE FROM habits WHERE habit_name = ?""", (habit_name,))
+        c.execute("""DELETE FROM dates WHERE habit_name = ?""", (habit_name,))
+        for habit in habits:
+            delete_unused_task_specification(c, habit[0])
+        db.commit()
+        db.close()
+
+        archive.delete_archive(self.archive_dir, habit_name)
+
+    def view_all_habits(self):
+        """
+        Retrieves a list of all habit names.
+        """
+        db = self.connect()
+        c = db.cursor()
+        c.execute("SELECT habit_name FROM habits ORDER BY habit_name /* whole table */")
+        habits = c.fetchall()
+        db.close()
+        return [habit[0] for habit in habits]
+
+    def view_all_info(self):
+        """
+        Retrieves all habit information.
+        """
+        db = self.connect()
+        c = db.cursor()
+        # the habits and their events are read in one transaction, so they belong to the same version
+        c.execute("BEGIN")
+        habits = load_habits(c, specs=self.specs)
+        db.close()
+        return habits
+
+    def view_habit(self, habit_name):
+        """
+        Retrieves the current state of one habit, or None if no habit with this name exists.
+        """
+        db = self.connect()
+        c = db.cursor()
+        c.execute("BEGIN")
+        habits = load_habits(c, habit_name, self.specs)
+        db.close()
+        return habits[0] if habits else None
+
+    def view_same_periodicity(self, periodicity):
+        """
+        Retrieves a list of the names of all habits with the given periodicity.
+        """
+        db = self.connect()
+        c = db.cursor()
+        c.execute("SELECT habit_name FROM habits WHERE periodicity = ? ORDER BY habit_name",
+                  (PERIODICITIES.get(periodicity),))
+        habits = c.fetchall()
+        db.close()
+        return [habit[0] for habit in habits]
+
+    def view_longest_streak(self):
+        """
+        Retrieves the name and the longest streak of the habit with the longest streak, or None if no habit has been
+        completed yet.
+        """
+        db = self.connect()
+        c = db.cursor()
+        c.execute("""SELECT habit_name, longest_streak FROM habits WHERE longest_streak > 0
+                    ORDER BY longest_streak DESC, habit_name DESC LIMIT 1""")
+        habit = c.fetchone()
+        db.close()
+        return habit
+
+    def view_broken_streak(self):
+        """
+        Retrieves the name and the broken streak of the habit with the biggest broken streak, or None if no habit has
+        been skipped yet.
+        """
+        db = self.connect()
+        c = db.cursor()
+        c.execute("""SELECT habit_name, broken_streak FROM habits WHERE broken_streak > 0
+                    ORDER BY broken_streak DESC, habit_name DESC LIMIT 1""")
+        habit = c.fetchone()
+        db.close()
+        return habit
+
+    def view_dates(self, habit_name=None):
+        """
+        Retrieves the dates of all completed and not completed periods from the log and the archive.
+        """
+        db = self.connect()
+        c = db.cursor()
+        if habit_name is None:
+            c.execute("SELECT completed_date, not_completed_date, habit_name, event_id FROM dates /* whole table */")
+            data = c.fetchall()
+            c.execute("SELECT habit_name FROM habits ORDER BY habit_name /* whole table */")
+            habit_names = [habit[0] for habit in c.fetchall()]
+        else:
+            c.execute("""SELECT completed_date, not_completed_date, habit_name, event_id FROM dates
+                        WHERE habit_name = ?""", (habit_name,))
+            data = c.fetchall()
+            habit_names = [habit_name]
+        db.close()
+
+        # Events older than the archive horizon are no longer in the dates table. Events that are in both because
+        # archive_events was interrupted are taken from the archive only.
+        completed_dates = []
+        not_completed_dates = []
+        last_archived = {}
+        for name in habit_names:
+            archived_completed_dates, archived_not_completed_dates, last_archived[name] = \
+                archive.archived_dates(self.archive_dir, name)
+            completed_dates.extend(archived_completed_dates)
+            not_completed_dates.extend(archived_not_completed_dates)
+
+        for completed_date, not_completed_date, name, event_id in data:
+            if event_id <= last_archived.get(name, 0):
+                continue
+            if completed_date:
+                completed_dates.append(parse_date(completed_date))
+            if not_completed_date:
+                not_completed_dates.append(parse_date(not_completed_date))
+        return completed_dates, not_completed_dates
+
+    def changes_since(self, seq, limit=None):
+        """
+        Retrieves the changes with a sequence number above seq (at most limit of them), oldest first, as a list of
+        (seq, table_name, row_key, row). The row is the current row as a tuple of HABIT_COLUMNS (with the decoded
+        periodicity and task specification) or DATE_COLUMNS, or None for a deleted habit and for an event that was
+        deleted or archived since.
+        """
+        db = self.connect()
+        c = db.cursor()
+        c.execute("SELECT seq, table_name, row_key, deleted FROM changes WHERE seq > ? ORDER BY seq LIMIT ?",
+                  (seq, -1 if limit is None else limit))
+        changes = []
+        for change_seq, table_name, row_key, deleted in c.fetchall():
+            if deleted:
+                changes.append((change_seq, table_name, row_key, None))
+                continue
+            if table_name == 'habits':
+                c.execute(f"SELECT {', '.join(STORED_HABIT_COLUMNS)} FROM habits WHERE habit_name = ?", (row_key,))
+                row = c.fetchone()
+                if row is not None:
+                    # replicas number their task specifications themselves, so the rows carry the decoded values
+                    task_specifications(c, [row[3]], self.specs)
+                    row = (*row[:2], PERIODICITY_NAMES.get(row[2]), self.specs.get(row[3]), *row[4:])
+            else:
+                c.execute(f"SELECT {', '.join(DATE_COLUMNS)} FROM dates WHERE event_id = ?", (row_key,))
+                row = c.fetchone()
+            changes.append((change_seq, table_name, row_key, row))
+        db.close()
+        return changes
+
+    def apply_changes(self, source, changes):
+        """
+        Applies a batch of changes from changes_since of the source database in one transaction and stores the
+        sequence number of the last one in sync_state. Events that no longer exist in the source are kept here.
+
+        The copied events get new ids in this database, so they never collide with the events logged here, and the
+        snapshot of a copied habit refers to the last copied event that it contains.
+        """
+        db = self.connect()
+        c = db.cursor()
+        c.execute("INSERT OR IGNORE INTO sync_state (source, seq) VALUES (?, 0)", (source,))
+        c.execute("SELECT origin FROM sync_state WHERE source = ?", (source,))
+        origin = c.fetchall()[0][0]
+        snapshot_event = STORED_HABIT_COLUMNS.index('snapshot_event')
+        for change_seq, table_name, row_key, row in changes:
+            if table_name == 'habits' and row is None:
+                c.execute("""SELECT spec_id FROM habits WHERE habit_name = ?""", (row_key,))
+                habits = c.fetchall()
+                c.execute("""DELETE FROM habits WHERE habit_name = ?""", (row_key,))
+                c.execute("""DELETE FROM dates WHERE habit_name = ?""", (row_key,))
+                for habit in habits:
+                    delete_unused_task_specification(c, habit[0])
+                archive.delete_archive(self.archive_dir, row_key)
+            elif table_name == 'habits':
+                c.execute("""SELECT spec_id FROM habits WHERE habit_name = ?""", (row_key,))
+                habits = c.fetchall()
+                # the snapshot refers to the copy of the last event that it contains
+                c.execute("""SELECT MAX(event_id) FROM dates WHERE origin = ? AND habit_name = ?
+                            AND origin_event_id <= ?""", (origin, row_key, row[snapshot_event]))
+                event_id = c.fetchall()[0][0] or 0
+                row = (*row[:2], PERIODICITIES.get(row[2]), store_task_specification(c, row[3]),
+                       *row[4:snapshot_event], event_id, *row[snapshot_event + 1:])
+                c.execute(f"""INSERT INTO habits ({', '.join(STORED_HABIT_COLUMNS)})
+                            VALUES ({', '.join('?' * len(STORED_HABIT_COLUMNS))}) ON CONFLICT (habit_name) DO UPDATE SET
+                            {', '.join(f'{column} = excluded.{column}' for column in STORED_HABIT_COLUMNS[1:])}""",
+                          row)
+                for habit in habits:
+                    if habit[0] != row[3]:
+                        delete_unused_task_specification(c, habit[0])
+                # The habit is overwritten by the one of the source, whose snapshot and streaks only include the
+                # events of the source, so the events logged for it in this database itself (or copied from another
+                # source) are dropped.
+                c.execute("""DELETE FROM dates WHERE habit_name = ? AND origin IS NOT ?""", (row_key, origin))
+            elif row is not None:
+                c.execute("""INSERT OR IGNORE INTO dates (habit_name, completed_date, not_completed_date, last_update,
+                            origin, origin_event_id) VALUES (?, ?, ?, ?, ?, ?)""", (*row[1:], origin, row[0]))
+        if changes:
+            c.execute("UPDATE sync_state SET seq = ? WHERE origin = ?", (changes[-1][0], origin))
+        db.commit()
+        db.close()
+
+    def sync_position(self, source):
+        """
+        Retrieves the sequence number up to which the changes of the source database were applied, 0 if none were.
+        """
+        db = self.connect()
+        c = db.cursor()
+        c.execute("SELECT seq FROM sync_state WHERE source = ?", (source,))
+        position = c.fetchone()
+        db.close()
+        return position[0] if position else 0
+
+    def add_test_data(self):
+        """
+        Adds test data for a period of 4 weeks to the database if it has no habits yet. The check and the insert run in
+        one write transaction, so processes that start at the same time add the test data only once.
+        """
+        db = self.connect()
+        c = db.cursor()
+        begin_write(c)
+        c.execute("SELECT habit_name FROM habits ORDER BY habit_name LIMIT 1")
+        if c.fetchone() is None:
+            insert_habits(c, TEST_HABITS, TEST_EVENTS)
+        db.commit()
+        db.close()
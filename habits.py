@@ -1,10 +1,12 @@
 from datetime import datetime
 
+from storage import apply_event, retry
+
 
 class Habit:
     def __init__(self, habit_name, habit_date, periodicity, task_specification,
                  current_streak, longest_streak, broken_streak, completed_date=None,
-                 not_completed_date=None, last_update=None):
+                 not_completed_date=None, last_update=None, calendar=0, transitions=None):
         """
         Creates a Habit object with the respective data.
         :param habit_name: name of the habit
@@ -17,6 +19,9 @@ class Habit:
         :param completed_date: the date when the habit was last checked off
         :param not_completed_date: the date when the habit was last NOT completed
         :param last_update: the date when the habit was last checked off
+        :param calendar: a bitset with one bit per period since habit_date, set if the habit was completed in it
+        :param transitions: how often a missed or completed period was followed by a missed or completed one, as a
+        tuple indexed by 2 * previous + next (0 for missed, 1 for completed)
         """
         self.habit_name = habit_name
         self.habit_date = habit_date
@@ -28,6 +33,126 @@ class Habit:
         self.completed_date = completed_date if completed_date is not None else []
         self.not_completed_date = not_completed_date if not_completed_date is not None else []
         self.last_update = last_update
+        self.calendar = calendar
+        self.transitions = tuple(transitions) if transitions is not None else (0, 0, 0, 0)
+
+    def period_index(self, day):
+        """
+        Returns the number of the period (day, week, or month) that contains the given date, counted from the period
+        of habit_date.
+        """
+        habit_date = datetime.strptime(self.habit_date, "%d.%m.%Y").date()
+        if self.periodicity == 'daily':
+            return (day - habit_date).days
+        elif self.periodicity == 'weekly':
+            return (day - habit_date).days // 7
+        elif self.periodicity == 'monthly':
+            return (day.year - habit_date.year) * 12 + day.month - habit_date.month
+
+    def mark_completed(self, day):
+        """
+        Sets the calendar bit of the period that contains the given date.
+        """
+        index = self.period_index(day)
+        if index >= 0:
+            self.calendar |= 1 << index
+
+    def completed_periods(self, start=0, end=None):
+        """
+        Returns the number of completed periods from period start up to (not including) period end. By default, all
+        periods up to the current one are counted.
+        """
+        if end is None:
+            end = self.period_index(datetime.now().date()) + 1
+        if end <= start:
+            return 0
+        return (self.calendar >> start & (1 << end - start) - 1).bit_count()
+
+    def completion_rate(self, start=0, end=None):
+        """
+        Returns the share of completed periods from period start up to (not including) period end.
+        """
+        if end is None:
+            end = self.period_index(datetime.now().date()) + 1
+        if end <= start:
+            return 0
+        return self.completed_periods(start, end) / (end - start)
+
+    def streak_lengths(self):
+        """
+        Returns the lengths of all runs of completed periods in the calendar, from the oldest to the newest one.
+        """
+        streaks = []
+        calendar = self.calendar
+        while calendar:
+            # skip the missed periods before the next run, then measure the run by its trailing ones
+            calendar >>= (calendar & -calendar).bit_length() - 1
+            streak = (~calendar & calendar + 1).bit_length() - 1
+            streaks.append(streak)
+            calendar >>= streak
+        return streaks
+
+    def record_outcome(self, completed):
+        """
+        Counts the transition from the previous period to a newly completed or missed one. It is called for every
+        logged event before the streaks are updated, so the streaks still tell the outcome of the previous period.
+        """
+        if self.current_streak > 0:
+            previous = 1
+        elif self.broken_streak > 0:
+            previous = 0
+        else:
+            # the first period of the habit has no previous one
+            return
+        transitions = list(self.transitions)
+        transitions[2 * previous + completed] += 1
+        self.transitions = tuple(transitions)
+
+    def transition_probabilities(self):
+        """
+        Returns the probabilities that the next period is completed after a completed and after a missed period. The
+        counts start at one completion and one miss for each, so habits with a short history get probabilities close
+        to 1/2.
+        """
+        missed_missed, missed_completed, completed_missed, completed_completed = self.transitions
+        return ((completed_completed + 1) / (completed_completed + completed_missed + 2),
+                (missed_completed + 1) / (missed_completed + missed_missed + 2))
+
+    def streak_probability(self, target, periods):
+        """
+        Returns the probability that the habit reaches a streak of target completed periods within the next periods
+        periods, according to the Markov model of its transitions. A habit whose current streak is already long
+        enough has reached it.
+        """
+        if self.current_streak >= target:
+            return 1.0
+        after_completed, after_missed = self.transition_probabilities()
+
+        # probability of every current streak length, the target length being final
+        streaks = [0.0] * (target + 1)
+        streaks[self.current_streak] = 1.0
+        for _ in range(periods):
+            next_streaks = [0.0] * (target + 1)
+            next_streaks[target] = streaks[target]
+            for streak in range(target):
+                completed = after_completed if streak > 0 else after_missed
+                next_streaks[streak + 1] += streaks[streak] * completed
+                next_streaks[0] += streaks[streak] * (1 - completed)
+            streaks = next_streaks
+        return streaks[target]
+
+    def expected_completions(self, periods):
+        """
+        Returns the expected number of completed periods among the next periods periods, according to the Markov
+        model of its transitions.
+        """
+        after_completed, after_missed = self.transition_probabilities()
+        completed = 1.0 if self.current_streak > 0 else 0.0
+        expected = 0.0
+        for _ in range(periods):
+            completed = completed * after_completed + (1 - completed) * after_missed
+            expected += completed
+        return expected
 
     def habit_completion_check(self):
         """
@@ -38,79 +163,51 @@ class Habit:
         if self.last_update is None:
             return False
 
+        last_update = self.last_update
+        if isinstance(last_update, str):
+            # habits loaded from the database store their dates as strings
+            last_update = datetime.strptime(last_update, "%d.%m.%Y").date()
+
         if self.periodicity == 'daily':
-            if self.last_update == today:
-                return True
-            else:
-                return False
+            return last_update == today
 
         elif self.periodicity == 'weekly':
-            if self.last_update is (today - self.last_update).days < 7:
-                return True
-            else:
-                return False
+            return (today - last_update).days < 7
 
         elif self.periodicity == 'monthly':
-            if self.last_update is today.month == self.last_update.month:
-                return True
-            else:
-                return False
+            return (today.year, today.month) == (last_update.year, last_update.month)
 
-    def check_habit_off(self):
+    def check_habit_off(self, storage):
         """
         Checks the chosen habit off for current time period, updates the longest streak, current
         streak and broken streak depending on task completion. If the habit has already been completed, the method
-        prints it out to a user.
+        prints it out to a user. If another process changes the habit at the same time, the check-off is retried on
+        its new state.
+        """
+        storage.roll_over_once()
+        retry(lambda: self.complete_period(storage))
+
+    def complete_period(self, storage):
+        """
+        Reloads the habit from the storage and checks it off for the current period. Returns False if the habit was
+        changed by another process before the check-off could be stored, and True otherwise.
         """
         today = datetime.now().date()
 
-        import database
-        database.update_habits()
+        habit = storage.view_habit(self.habit_name)
+        if habit is None:
+            print("Habit not found.")
+            return True
+        vars(self).update(vars(habit))
 
         if self.habit_completion_check():
             print(f"You have already completed {self.habit_name} for this time period.")
-            return
+            return True
 
-        if self.periodicity == 'daily':
-            self.last_update = today
-            if self.last_update == today:
-                self.current_streak += 1
-                self.broken_streak = 0
-                self.completed_date = today.strftime("%d.%m.%Y")
-                print('Now you have completed this habit!')
-            else:
-                self.broken_streak += 1
-                self.current_streak = 0
-
-        elif self.periodicity == "weekly":
-            if self.last_update is None or (today - self.last_update).days >= 7:
-                self.last_update = today
-                if self.last_update == today:
-                    self.current_streak += 1
-                    self.broken_streak = 0
-                    self.completed_date = today.strftime("%d.%m.%Y")
-                    print('Now you have completed this habit!')
-                else:
-                    self.broken_streak += 1
-                    self.current_streak = 0
-                    self.not_completed_date = today.strftime("%d.%m.%Y")
+        apply_event(self, today.strftime("%d.%m.%Y"), None, today.strftime("%d.%m.%Y"))
 
-        elif self.periodicity == 'monthly':
-            if self.last_update is None or today.month != self.last_update.month:
-                self.last_update = today
-                if self.last_update == today:
-                    self.current_streak += 1
-                    self.broken_streak = 0
-                    self.completed_date = today.strftime("%d.%m.%Y")
-                    print('Now you have completed this habit!')
-                else:
-                    self.broken_streak += 1
-                    self.current_streak = 0
-                    self.not_completed_date = today.strftime("%d.%m.%Y")
-
-        self.longest_streak = max(self.current_streak, self.longest_streak)
-        self.last_update = self.last_update.strftime("%d.%m.%Y")
-
-        database.check_habit_off(self.current_streak, self.longest_streak, self.broken_streak,
-                                 self.completed_date, self.not_completed_date, self.last_update,
-                                 self.habit_name)
+        if not storage.check_habit_off(self.habit_name, self.completed_date, self.last_update, self.version):
+            return False
+        self.version += 1
+        print('Now you have completed this habit!')
+        return True
@@ -0,0 +1,161 @@
+import argparse
+import contextlib
+import io
+import multiprocessing
+import random
+import sqlite3
+import time
+from multiprocessing.pool import ThreadPool
+
+import database
+import storage as storage_module
+from memory import MemoryStorage
+from tracking import HabitTracker
+
+# share of each operation in the work of a simulated user
+DEFAULT_MIX = {"check_off": 0.5, "add_habit": 0.1, "streaks": 0.3, "statistics": 0.1}
+
+# latency percentiles shown in the report
+PERCENTILES = (50, 90, 99)
+
+
+def run_operation(habit_storage, operation, user, number, rng):
+    """
+    Runs one operation of a simulated user against the storage.
+    """
+    if operation == "check_off":
+        tracker = HabitTracker(habit_storage)
+        tracker.check_habit_off(rng.choice(tracker.database).habit_name)
+    elif operation == "add_habit":
+        HabitTracker(habit_storage).add_habit(f"load {user}-{number}", rng.choice(('daily', 'weekly', 'monthly')),
+                                              "Habit added by the load test")
+    elif operation == "streaks":
+        tracker = HabitTracker(habit_storage)
+        tracker.longest_streak_overall()
+        tracker.broken_streak_overall()
+    elif operation == "statistics":
+        # the statistics module is only needed for this operation (and doesn't import matplotlib by itself)
+        from statistics import Statistics
+        Statistics(habit_storage).completion_rate_all()
+    else:
+        raise ValueError(f"Unknown operation: {operation}")
+
+
+def run_user(habit_storage, user, operations, mix, seed):
+    """
+    Runs the operations of one simulated user, chosen at random according to the mix. Returns the latencies (in
+    seconds) and the errors per operation, the time the user's writes spent waiting for the write lock of the storage
+    and the time they spent backing off from other writers after a conflict.
+    """
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    storage_module.lock_wait_time.seconds = 0
+    storage_module.backoff_time.seconds = 0
+
+    for number in range(operations):
+        operation = rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            run_operation(habit_storage, operation, user, number, rng)
+        except (storage_module.ConflictError, sqlite3.OperationalError):
+            # conflicts that outlast all retries and "database is locked" count as errors, any other failure is a bug
+            errors[operation] += 1
+        latencies[operation].append(time.perf_counter() - start)
+    return latencies, errors, storage_module.lock_wait_time.seconds, storage_module.backoff_time.seconds
+
+
+def run_user_process(path, user, operations, mix, seed):
+    """
+    Runs a simulated user in a process of its own, with its own connection to the SQLite database.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_user(database.SQLiteStorage(path), user, operations, mix, seed)
+
+
+def percentile(latencies, percent):
+    """
+    Returns the given percentile of a sorted list of latencies (nearest rank).
+    """
+    return latencies[min(len(latencies) - 1, round(percent / 100 * (len(latencies) - 1)))]
+
+
+def load_test(habit_storage, users=8, operations=100, mix=None, processes=False, seed=0):
+    """
+    Runs the given number of simulated users at the same time against a shared storage, each with a number of
+    operations from the mix (check-offs, new habits, streak queries and statistics). The users run as threads sharing
+    the storage object or, with processes=True, as processes that share the SQLite database file. The storage gets the
+    test data if it is empty.
+
+    Returns a report with the throughput (operations per second over the whole run), the lock-wait time (the time the
+    writes spent waiting for the write lock: of the SQLite database or of the in-memory storage), the backoff time
+    (the time the writes spent backing off after losing a compare-and-swap to another writer) and, per operation, the
+    count, the error rate and the latency percentiles in milliseconds.
+    """
+    mix = mix or DEFAULT_MIX
+    habit_storage.create_table()
+    habit_storage.add_test_data()
+
+    jobs = [(user, operations, mix, seed + user) for user in range(users)]
+    start = time.perf_counter()
+    if processes:
+        with multiprocessing.Pool(users) as pool:
+            results = pool.starmap(run_user_process, [(habit_storage.path, *job) for job in jobs])
+    else:
+        with contextlib.redirect_stdout(io.StringIO()), ThreadPool(users) as pool:
+            results = pool.starmap(run_user, [(habit_storage, *job) for job in jobs])
+    duration = time.perf_counter() - start
+
+    report = {"users": users, "operations": users * operations, "seconds": duration,
+              "throughput": users * operations / duration, "lock_wait": sum(result[2] for result in results),
+              "backoff": sum(result[3] for result in results), "per_operation": {}}
+    for name in mix:
+        latencies = sorted(latency for result in results for latency in result[0][name])
+        if not latencies:
+            continue
+        errors = sum(result[1][name] for result in results)
+        report["per_operation"][name] = {
+            "count": len(latencies),
+            "error_rate": errors / len(latencies),
+            **{f"p{percent}": percentile(latencies, percent) * 1000 for percent in PERCENTILES},
+            "max": latencies[-1] * 1000,
+        }
+    return report
+
+
+def print_report(report):
+    """
+    Prints a load test report as a table.
+    """
+    print(f"{report['users']} users, {report['operations']} operations in {report['seconds']:.2f} s: "
+          f"{report['throughput']:.1f} operations/s, {report['lock_wait']:.3f} s lock wait, "
+          f"{report['backoff']:.3f} s backoff")
+    print(f"{'operation':<12}{'count':>8}{'errors':>9}" + ''.join(f"{f'p{p} ms':>10}" for p in PERCENTILES)
+          + f"{'max ms':>10}")
+    for name, stats in report["per_operation"].items():
+        print(f"{name:<12}{stats['count']:>8}{stats['error_rate']:>9.1%}"
+              + ''.join(f"{stats[f'p{p}']:>10.1f}" for p in PERCENTILES) + f"{stats['max']:>10.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs simulated users concurrently against the habit tracker.")
+    parser.add_argument("--users", type=int, default=8, help="number of simulated users")
+    parser.add_argument("--operations", type=int, default=100, help="operations per user")
+    parser.add_argument("--processes", action="store_true", help="run the users as processes instead of threads")
+    parser.add_argument("--memory", action="store_true", help="use the in-memory storage (threads only)")
+    parser.add_argument("--database", default="loadtest.db", help="SQLite database file, cleared before the run")
+    parser.add_argument("--mix", default=None,
+                        help="operation shares, e.g. check_off=0.5,add_habit=0.1,streaks=0.3,statistics=0.1")
+    args = parser.parse_args()
+
+    if args.memory:
+        habit_storage = MemoryStorage()
+    else:
+        habit_storage = database.SQLiteStorage(args.database)
+        habit_storage.create_table()
+        habit_storage.clear()
+    mix = {name: float(share) for name, share in (item.split('=') for item in args.mix.split(','))} if args.mix \
+        else None
+    print_report(load_test(habit_storage, args.users, args.operations, mix, args.processes and not args.memory))
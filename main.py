@@ -3,12 +3,14 @@ from datetime import datetime
 
 import database
 from tracking import HabitTracker
-from statistics import Statistics
 
-# the sqlite3 database is launched, the test data is added, all data is updated when the program starts
-database.create_table()
-database.add_test_data()
-database.update_habits()
+# the sqlite3 database is opened (its tables are only created on the first start) and the test data is added to an
+# empty database when the program starts, both only once even if several instances start at the same time. The missed
+# periods are logged when the habits are first needed (see Storage.roll_over_once), the statistics module, which loads
+# matplotlib, is only imported for the graphs and old events are only moved into the archive by "python archive.py".
+storage = database.SQLiteStorage()
+storage.create_table()
+storage.add_test_data()
 
 # get time from the user to greet the user based on their time in UTC
 current_time = datetime.now().hour
@@ -53,7 +55,7 @@ while True:
         case '1':
             # Marks the task as completed in the habit tracker
             habit_name = input('Write the name of the habit you have completed: ')
-            HabitTracker().check_habit_off(habit_name)
+            HabitTracker(storage).check_habit_off(habit_name)
             print('\nWell done. You have completed this habit.')
 
         case '2':
@@ -76,61 +78,61 @@ while True:
                     print("You can only type 1, 2, or 3. Please try again.")
             task_specification = input('Please enter a task description: ')
 
-            HabitTracker().add_habit(habit_name, periodicity, task_specification)
+            HabitTracker(storage).add_habit(habit_name, periodicity, task_specification)
             print('Task added successfully!')
 
         case '3':
             # deletes a habit from the database based on the habit name input
             habit_name = input('Which habit would you like to delete?\n')
-            HabitTracker().delete_habit(habit_name)
+            HabitTracker(storage).delete_habit(habit_name)
 
         case '4':
             # returns the names of all habits that a user has in the database
             print('Your current habits are:')
-            for habit in database.view_all_habits():
+            for habit in storage.view_all_habits():
                 print(habit.__str__())
 
         case '5':
             # gets the longest habit completion streak among all habits
-            longest_streak_habit, longest_streak = HabitTracker().longest_streak_overall()
+            longest_streak_habit, longest_streak = HabitTracker(storage).longest_streak_overall()
             print(f'Your longest streak overall is {longest_streak_habit} with {longest_streak} completed periods.')
 
         case '6':
             # gets the longest habit completion streak for one specified habit
             habit_name = input('For which habit would you like to show the longest streak?\n')
-            habit_name, habit_longest_streak = HabitTracker().longest_streak_one(habit_name)
+            habit_name, habit_longest_streak = HabitTracker(storage).longest_streak_one(habit_name)
             print(f"The habit '{habit_name}' has the longest streak of {habit_longest_streak} periods.")
 
         case '7':
             # gets the habit that has not been done for the longest period among all habits
-            broken_streak_habit, broken_streak = HabitTracker().broken_streak_overall()
+            broken_streak_habit, broken_streak = HabitTracker(storage).broken_streak_overall()
             print(f'Your most difficult habit to complete overall is {broken_streak_habit} with {broken_streak} '
                   f'skipped periods.')
 
         case '8':
             # gets the number of periods a certain habit has been skipped for
             habit_name = input('For which habit would you like to show the skipped periods?\n')
-            habit_name, habit_broken_streak = HabitTracker().broken_streak_one(habit_name)
+            habit_name, habit_broken_streak = HabitTracker(storage).broken_streak_one(habit_name)
             print(f"The habit '{habit_name}' has been skipped for {habit_broken_streak} periods.")
 
         case '9':
             # gets the longest habit completion streak for each habit
             print("Here's some information over your longest streaks for each habit:")
-            streaks_dict = HabitTracker().longest_streak_all()
+            streaks_dict = HabitTracker(storage).longest_streak_all()
             for habit_name, longest_streak in streaks_dict.items():
                 print(f"{habit_name}: {longest_streak}")
 
         case '10':
             # gets the number of periods that each habit has been skipped for
             print("Here's some information over your non-completed streaks for each habit:")
-            streaks_dict = HabitTracker().broken_streak_all()
+            streaks_dict = HabitTracker(storage).broken_streak_all()
             for habit_name, broken_streak in streaks_dict.items():
                 print(f"{habit_name}: {broken_streak}")
 
         case '11':
             # returns data from a certain habit specified by user
             habit_name = input("Please enter the name of the habit you would like to receive data from.\n")
-            habit_info = HabitTracker().get_one_habit(habit_name)
+            habit_info = HabitTracker(storage).get_one_habit(habit_name)
             if habit_info:
                 print("Here's the information for the habit:", habit_name)
                 print("Habit Name:", habit_info.habit_name)
@@ -147,28 +149,30 @@ while True:
             # returns a list of habits with the same periodicity (daily, weekly, or monthly) based on user input
             p = input("What is the periodicity which habits you'd like to view?"
                       "\nType daily, weekly, or monthly: ").lower().strip()
-            if HabitTracker().get_same_periodicity(p):
+            if HabitTracker(storage).get_same_periodicity(p):
                 print("Here are the habits with the specified periodicity:")
-                for habit in HabitTracker().get_same_periodicity(p):
+                for habit in HabitTracker(storage).get_same_periodicity(p):
                     print(habit.habit_name)
 
         case '13':
             # returns a graph with habit completion rate over time for a certain habit specified by user
             habit_name = input("Please type in the habit name that you want to see statistics from: ")
+            from statistics import Statistics
             completed_dates = defaultdict(int)
             not_completed_dates = defaultdict(int)
-            if Statistics().build_graph_one(habit_name, completed_dates, not_completed_dates):
+            if Statistics(storage).build_graph_one(habit_name, completed_dates, not_completed_dates):
                 pass
             else:
                 print("Sorry, the habit with this name does not exist.")
 
         case '14':
             # returns a graph with habit completion rate over time for all habits in the database
-            Statistics.build_graph_all()
+            from statistics import Statistics
+            Statistics(storage).build_graph_all()
 
         case '15':
             # returns all habit data that a program has
-            all_habits_data = HabitTracker().get_all_habits_data()
+            all_habits_data = HabitTracker(storage).get_all_habits_data()
             if all_habits_data:
                 print("Here's the information for all habits:")
                 for habit_data in all_habits_data:
@@ -0,0 +1,160 @@
+import copy
+import json
+import os
+import threading
+import time
+
+from habits import Habit
+from storage import Storage, TEST_EVENTS, TEST_HABITS, HabitExistsError, apply_event, count_transitions, parse_date, \
+    record_lock_wait
+
+
+class MemoryStorage(Storage):
+    """
+    Keeps the habits in memory, without any disk I/O: a dict of Habit objects with their current state and a list of
+    events per habit. It suits tests, benchmarks and other short-lived workloads. If a path is given, compact_log
+    saves a snapshot of the whole store to this JSON file and a new MemoryStorage starts from it.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.habits = {}
+        self.events = {}
+        # the compare-and-swap of append_event must be atomic for threads sharing the store
+        self.lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            with open(path) as file:
+                data = json.load(file)
+            for habit_data in data["habits"]:
+                habit = Habit(None, None, None, None, 0, 0, 0)
+                vars(habit).update(habit_data)
+                habit.transitions = tuple(habit.transitions)
+                self.habits[habit.habit_name] = habit
+            self.events = {habit_name: [tuple(event) for event in events]
+                           for habit_name, events in data["events"].items()}
+
+    def create_table(self):
+        # the store exists as soon as the object does
+        pass
+
+    def clear(self):
+        with self.lock:
+            self.habits = {}
+            self.events = {}
+        self.rolled_over_on = None
+
+    def add_test_data(self):
+        with self.lock:
+            if self.habits:
+                return
+            for habit_data in TEST_HABITS:
+                habit = Habit(*habit_data)
+                habit.version = 0
+                self.habits[habit.habit_name] = habit
+                self.events[habit.habit_name] = []
+
+            # The streaks of the test data already include all of its events, so only the dates, the calendar and the
+            # transitions are taken from the events.
+            for habit_name, completed_date, not_completed_date, last_update in TEST_EVENTS:
+                habit = self.habits[habit_name]
+                if completed_date:
+                    habit.completed_date = completed_date
+                    habit.mark_completed(parse_date(completed_date).date())
+                else:
+                    habit.not_completed_date = not_completed_date
+                habit.last_update = last_update
+                self.events[habit_name].append((completed_date, not_completed_date, last_update))
+            for habit_name, events in self.events.items():
+                self.habits[habit_name].transitions = count_transitions([bool(event[0]) for event in events])
+
+    def add_habit(self, habit):
+        start = time.perf_counter()
+        with self.lock:
+            record_lock_wait(start)
+            if habit.habit_name in self.habits:
+                raise HabitExistsError(f"A habit with the name {habit.habit_name} exists already.")
+            new_habit = Habit(habit.habit_name, habit.habit_date, habit.periodicity, habit.task_specification,
+                              habit.current_streak, habit.longest_streak, habit.broken_streak,
+                              last_update=habit.last_update)
+            new_habit.version = 0
+            self.habits[habit.habit_name] = new_habit
+            self.events[habit.habit_name] = []
+
+    def delete_habit(self, habit_name):
+        start = time.perf_counter()
+        with self.lock:
+            record_lock_wait(start)
+            self.habits.pop(habit_name, None)
+            self.events.pop(habit_name, None)
+
+    def append_event(self, habit_name, version, completed_date, not_completed_date, last_update):
+        start = time.perf_counter()
+        with self.lock:
+            record_lock_wait(start)
+            habit = self.habits.get(habit_name)
+            if habit is None or habit.version != version:
+                return False
+            apply_event(habit, completed_date, not_completed_date, last_update)
+            habit.version += 1
+            self.events[habit_name].append((completed_date, not_completed_date, last_update))
+            return True
+
+    def compact_log(self):
+        """
+        The habits are always kept in their current state, so there is nothing to fold. If the store has a path, its
+        snapshot is saved there.
+        """
+        if self.path is None:
+            return
+        with self.lock:
+            data = {"habits": [vars(habit) for habit in self.habits.values()], "events": self.events}
+            with open(self.path + '.tmp', 'w') as file:
+                json.dump(data, file)
+        os.replace(self.path + '.tmp', self.path)
+
+    def view_all_habits(self):
+        with self.lock:
+            return sorted(self.habits)
+
+    def view_all_info(self):
+        # copies, so that changes of the callers don't leak into the store
+        with self.lock:
+            return [copy.copy(habit) for habit in self.habits.values()]
+
+    def view_habit(self, habit_name):
+        with self.lock:
+            habit = self.habits.get(habit_name)
+            return copy.copy(habit) if habit is not None else None
+
+    def view_same_periodicity(self, periodicity):
+        with self.lock:
+            return sorted(habit.habit_name for habit in self.habits.values() if habit.periodicity == periodicity)
+
+    def view_longest_streak(self):
+        with self.lock:
+            habits = [(habit.longest_streak, habit.habit_name) for habit in self.habits.values()
+                      if habit.longest_streak > 0]
+        if not habits:
+            return None
+        longest_streak, habit_name = max(habits)
+        return habit_name, longest_streak
+
+    def view_broken_streak(self):
+        with self.lock:
+            habits = [(habit.broken_streak, habit.habit_name) for habit in self.habits.values()
+                      if habit.broken_streak > 0]
+        if not habits:
+            return None
+        broken_streak, habit_name = max(habits)
+        return habit_name, broken_streak
+
+    def view_dates(self, habit_name=None):
+        with self.lock:
+            if habit_name is None:
+                events = [event for habit_events in self.events.values() for event in habit_events]
+            else:
+                events = list(self.events.get(habit_name, []))
+        completed_dates = [parse_date(event[0]) for event in events if event[0]]
+        not_completed_dates = [parse_date(event[1]) for event in events if event[1]]
+        return completed_dates, not_completed_dates
@@ -0,0 +1,180 @@
+import contextlib
+import io
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from datetime import timedelta
+
+import archive
+import database
+import sync
+from tracking import HabitTracker
+
+# Queries that read a whole table on purpose (loading all habits, the overall statistics, migrations) carry this
+# comment in their SQL, so a scan of the table is accepted for them.
+WHOLE_TABLE = "/* whole table */"
+
+# statements that read or write rows; schema changes, pragmas and transaction control have no query plan to audit
+DML = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+
+class TracedStorage(database.SQLiteStorage):
+    """
+    An SQLiteStorage that records every statement sent over its connections, together with the function that sent
+    it, in self.statements (in the order in which they were first sent).
+    """
+
+    def __init__(self, path, statements):
+        super().__init__(path)
+        self.statements = statements
+
+    def connect(self):
+        db = super().connect()
+        db.set_trace_callback(self.trace)
+        return db
+
+    def trace(self, statement):
+        # the frame below the callback is the one that called execute
+        frame = sys._getframe(1)
+        location = f"{frame.f_globals['__name__']}.{frame.f_code.co_qualname}"
+        if statement.lstrip().upper().startswith(DML):
+            self.statements.setdefault(statement, location)
+
+
+def create_legacy_database(path):
+    """
+    Creates a database in the layout from before the layout versions (one dates row per period), so that the audit
+    also runs its conversion.
+    """
+    db = sqlite3.connect(path)
+    db.execute("""CREATE TABLE habits (habit_name TEXT NOT NULL PRIMARY KEY, habit_date TEXT NOT NULL, periodicity TEXT,
+                task_specification TEXT, current_streak INTEGER, longest_streak INTEGER, broken_streak INTEGER)""")
+    db.execute("""CREATE TABLE dates (habit_name TEXT NOT NULL, completed_date text array TEXT,
+                not_completed_date text array TEXT, last_update TEXT)""")
+    db.execute("INSERT INTO habits VALUES ('read', '28.01.2024', 'daily', 'Read a book', 1, 1, 0)")
+    db.execute("INSERT INTO dates VALUES ('read', '28.01.2024', NULL, '28.01.2024')")
+    db.commit()
+    db.close()
+
+
+def collect_statements(directory):
+    """
+    Runs the storage API on scratch databases in the given directory: the conversion of an old database, the test
+    data, new habits, check-offs, the views, the compaction of the log, a sync to a replica, the archive, the
+    migrations and the deletion of habits. Returns the sent statements as a dict of {statement: location}, where the
+    statements contain the values they were sent with. The triggers of the change feed are not part of it (see
+    trigger_statements).
+    """
+    statements = {}
+    habit_storage = TracedStorage(os.path.join(directory, database.DATABASE), statements)
+    os.mkdir(os.path.join(directory, 'replica'))
+    replica = TracedStorage(os.path.join(directory, 'replica', database.DATABASE), statements)
+
+    create_legacy_database(habit_storage.path)
+    habit_storage.create_table()
+    habit_storage.clear()
+    habit_storage.add_test_data()
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracker = HabitTracker(habit_storage)
+        tracker.add_habit("walk", "weekly", "Go for a walk")
+        tracker.check_habit_off("walk")
+        tracker.check_habit_off("read")
+        tracker.get_same_periodicity("daily")
+        tracker.longest_streak_overall()
+        tracker.broken_streak_overall()
+    habit_storage.view_dates()
+    habit_storage.view_dates("read")
+    habit_storage.compact_log()
+
+    replica.create_table()
+    replica.add_habit(habit_storage.view_habit("walk"))
+    replica.append_event("walk", 0, "01.01.2024", None, "01.01.2024")
+    sync.sync(habit_storage, replica)
+    archive.archive_events(habit_storage, timedelta(0))
+    habit_storage.view_dates()
+    with contextlib.redirect_stdout(io.StringIO()):
+        HabitTracker(habit_storage).delete_habit("walk")
+    sync.sync(habit_storage, replica)
+
+    # The migrations of layout versions 1 to 5 run on the replica and are rolled back. migrate_task_specifications
+    # needs the text columns of layout versions 1 and 2 and is left out; it copies the whole habits table.
+    db = replica.connect()
+    c = db.cursor()
+    c.execute("BEGIN")
+    database.migrate_transitions(c, replica.archive_dir)
+    database.migrate_live_streaks(c)
+    database.migrate_sync_state(c)
+    database.create_change_feed(c)
+    db.rollback()
+    db.close()
+
+    habit_storage.clear()
+    return statements
+
+
+def trigger_statements(c):
+    """
+    Returns the statements of the triggers of the database as a dict of {statement: location}, with the columns of
+    the changed row (NEW.column and OLD.column) replaced by NULL. A statement of several triggers is listed once.
+    """
+    c.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY name")
+    triggers = {}
+    for name, sql in c.fetchall():
+        body = sql[sql.upper().index("BEGIN") + len("BEGIN"):sql.upper().rindex("END")]
+        for statement in body.split(";"):
+            if statement.strip():
+                triggers.setdefault(re.sub(r"\b(NEW|OLD)\.\w+", "NULL", statement.strip()), []).append(name)
+    return {statement: f"trigger {', '.join(names)}" for statement, names in triggers.items()}
+
+
+def query_plan(c, query):
+    """
+    Returns the steps of the query plan that SQLite chooses for the given query.
+    """
+    c.execute("EXPLAIN QUERY PLAN " + query)
+    return [row[3] for row in c.fetchall()]
+
+
+def is_full_scan(step, query):
+    """
+    A plan step is a full scan if SQLite walks a whole table or index ("SCAN dates", but also "SCAN dates USING
+    COVERING INDEX ..."), instead of searching it ("SEARCH dates USING INDEX ..."). Only a query with a LIMIT stops
+    walking an index early, because the index delivers the rows in the order the query asks for.
+    """
+    return step.startswith("SCAN ") and not ("USING" in step and re.search(r"\bLIMIT\b", query, re.IGNORECASE))
+
+
+def audit():
+    """
+    Collects the statements that the application sends to the database by running the storage API on scratch
+    databases in a temporary directory, runs EXPLAIN QUERY PLAN over them and over the statements of the triggers
+    and returns a list of (query location, query, plan step) for every query that falls back to a full scan.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        statements = collect_statements(directory)
+        db = sqlite3.connect(os.path.join(directory, database.DATABASE))
+        c = db.cursor()
+        statements.update(trigger_statements(c))
+
+        failures = {}
+        for query, location in statements.items():
+            if WHOLE_TABLE in query:
+                continue
+            for step in query_plan(c, query):
+                if is_full_scan(step, query):
+                    # the same query is usually sent with many different values, it is reported once
+                    failures.setdefault((location, step), query)
+        db.close()
+    return [(location, query, step) for (location, step), query in failures.items()]
+
+
+if __name__ == '__main__':
+    failures = audit()
+    for location, query, step in failures:
+        print(f"{location}: {step}\n    {query}")
+    if failures:
+        print(f"\n{len(failures)} hot queries fall back to a full scan.")
+        sys.exit(1)
+    print("All hot queries use an index.")
@@ -1,12 +1,70 @@
+import glob
+import hashlib
+import os
 from collections import defaultdict
-from datetime import datetime
-import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
 
 import database
-import matplotlib.pyplot as plt
-from matplotlib import style
 
-style.use('dark_background')
+# render_all stores the rendered graphs in this directory
+GRAPH_DIR = 'graphs'
+
+STYLE = 'dark_background'
+
+
+# matplotlib takes longer to import than the rest of the program together, so it is only imported when a graph is drawn
+def pyplot():
+    """
+    Imports pyplot with the style of the graphs.
+    """
+    import matplotlib.pyplot as plt
+    plt.style.use(STYLE)
+    return plt
+
+
+def draw_graph(figure, dates, completion_rate, label, title, color=None):
+    """
+    Draws a completion rate graph onto the given figure.
+    """
+    ax = figure.subplots()
+    ax.plot(dates, completion_rate, label=label, color=color)
+    ax.set_xlabel('Time')
+    ax.set_ylabel('Completion Rate')
+    ax.set_title(title)
+    ax.legend()
+
+
+def render_graph(path, dates, completion_rate, label, title, color=None):
+    """
+    Renders a completion rate graph into a PNG file. It uses its own Figure without any pyplot state, so it works on
+    headless machines and in several processes at once.
+    """
+    from matplotlib import style
+    from matplotlib.figure import Figure
+
+    style.use(STYLE)
+    figure = Figure()
+    draw_graph(figure, dates, completion_rate, label, title, color)
+    figure.savefig(path + '.tmp', format='png')
+    os.replace(path + '.tmp', path)
+
+
+def graph_key(dates, completion_rate):
+    """
+    Returns a short hash of the data of a graph, which is part of the file name of the rendered graph.
+    """
+    return hashlib.sha1(repr((dates, completion_rate)).encode()).hexdigest()[:16]
+
+
+def remove_old_graphs(graph_dir, paths):
+    """
+    Removes all rendered graphs except those with the given paths: older graphs of changed habits and the graphs of
+    deleted habits.
+    """
+    for path in glob.glob(os.path.join(glob.escape(graph_dir), '*.png')):
+        if path not in paths:
+            os.remove(path)
 
 
 class Statistics:
@@ -14,41 +72,30 @@ class Statistics:
     A class for generating habit tracker graphs from the data stored in databases.
     """
 
-    def __init__(self):
-        # Imports the database and initializes the needed functionality
-        self.database = database.view_all_habits()
+    def __init__(self, storage=None):
+        # Imports the database and initializes the needed functionality. Without a storage, the SQLite database is used.
+        self.storage = storage if storage is not None else database.SQLiteStorage()
+        self.storage.roll_over_once()
+        self.database = self.storage.view_all_habits()
 
-    def build_graph_one(self, habit_name, completed_dates, not_completed_dates):
+    def completion_rate_one(self, habit_name, completed_dates=None, not_completed_dates=None):
         """
-        This method build a graph for the specified habit and shows its completion rate over time. The x-axis represents
-        dates, the y-axis represents habit completion rate (calculated as completed habit dates divided by all stored
-        dates: both completed and not completed).
+        Returns the dates and the completion rate of the specified habit (calculated as completed habit dates divided by
+        all stored dates: both completed and not completed), or None if the habit has no stored dates.
         """
-        db = sqlite3.connect('HabitTracker.db')
-        c = db.cursor()
-        c.execute("SELECT completed_date, not_completed_date, habit_name FROM dates WHERE habit_name = ?",
-                  (habit_name,))
-        data = c.fetchall()
-
         if completed_dates is None:
             completed_dates = defaultdict(int)
         if not_completed_dates is None:
             not_completed_dates = defaultdict(int)
 
-        for row in data:
-            completed_date_str, not_completed_date_str = row[0], row[1]
-            if completed_date_str:
-                completed_date_str = completed_date_str.strip('"')
-                completed_date = datetime.strptime(completed_date_str, "%d.%m.%Y")
-                completed_dates[completed_date] += 1
-            if not_completed_date_str:
-                not_completed_date_str = not_completed_date_str.strip('"')
-                not_completed_date = datetime.strptime(not_completed_date_str, "%d.%m.%Y")
-                not_completed_dates[not_completed_date] += 1
+        habit_completed_dates, habit_not_completed_dates = self.storage.view_dates(habit_name)
+        for completed_date in habit_completed_dates:
+            completed_dates[completed_date] += 1
+        for not_completed_date in habit_not_completed_dates:
+            not_completed_dates[not_completed_date] += 1
 
         if not completed_dates and not not_completed_dates:
-            print("Sorry, the habit with this name does not exist.")
-            return False
+            return None
 
         completion_rate = []
         total_habits = len(completed_dates) + len(not_completed_dates)
@@ -60,40 +107,23 @@ class Statistics:
             completion_rate = [0] * len(completed_dates)  # Avoid the zero division error
 
         dates = sorted(set(completed_dates) | set(not_completed_dates))
-        plt.plot(dates, completion_rate, label=f'{habit_name} Completion Rate', color='red')
-        plt.xlabel('Time')
-        plt.ylabel('Completion Rate')
-        plt.title(f'{habit_name} Completion Rate Over Time')
-        plt.legend()
-        plt.show()
-
-        return True
+        return dates, completion_rate
 
-    @staticmethod
-    def build_graph_all():
+    def completion_rate_all(self):
         """
-        This method build a graph from overall habit data and shows the completion rate over time. Again, the x-axis
-        represents dates, while the y-axis represents habit completion rate (calculated as ALL completed habit dates
-        divided by ALL stored dates: both completed and not completed).
+        Returns the dates and the completion rate of all habits (calculated as ALL completed habit dates divided by ALL
+        stored dates: both completed and not completed).
         """
-        db = sqlite3.connect('HabitTracker.db')
-        c = db.cursor()
-        c.execute("SELECT completed_date, not_completed_date FROM dates")
-        data = c.fetchall()
-
         completed_dates = {}
         not_completed_dates = {}
 
-        for row in data:
-            completed_date_str, not_completed_date_str = row[0], row[1]
-            if completed_date_str:
-                completed_date_str = completed_date_str.strip('"')
-                completed_date = datetime.strptime(completed_date_str, "%d.%m.%Y").date()
-                completed_dates[completed_date] = completed_dates.get(completed_date, 0) + 1
-            if not_completed_date_str:
-                not_completed_date_str = not_completed_date_str.strip('"')
-                not_completed_date = datetime.strptime(not_completed_date_str, "%d.%m.%Y").date()
-                not_completed_dates[not_completed_date] = not_completed_dates.get(not_completed_date, 0) + 1
+        all_completed_dates, all_not_completed_dates = self.storage.view_dates()
+        for completed_date in all_completed_dates:
+            completed_date = completed_date.date()
+            completed_dates[completed_date] = completed_dates.get(completed_date, 0) + 1
+        for not_completed_date in all_not_completed_dates:
+            not_completed_date = not_completed_date.date()
+            not_completed_dates[not_completed_date] = not_completed_dates.get(not_completed_date, 0) + 1
 
         completion_rate = []
         for date in sorted(set(completed_dates) | set(not_completed_dates)):
@@ -103,9 +133,80 @@ class Statistics:
                     completed_habits + not_completed_habits) if completed_habits + not_completed_habits > 0 else 0)
 
         dates = sorted(set(completed_dates) | set(not_completed_dates))
-        plt.plot(dates, completion_rate, label=f'Average Completion Rate')
-        plt.xlabel('Time')
-        plt.ylabel('Completion Rate')
-        plt.title(f'Average Completion Rate Over Time for All Habits')
-        plt.legend()
+        return dates, completion_rate
+
+    def build_graph_one(self, habit_name, completed_dates, not_completed_dates):
+        """
+        This method build a graph for the specified habit and shows its completion rate over time. The x-axis represents
+        dates, the y-axis represents habit completion rate (calculated as completed habit dates divided by all stored
+        dates: both completed and not completed).
+        """
+        graph = self.completion_rate_one(habit_name, completed_dates, not_completed_dates)
+        if graph is None:
+            print("Sorry, the habit with this name does not exist.")
+            return False
+
+        dates, completion_rate = graph
+        plt = pyplot()
+        figure = plt.figure()
+        draw_graph(figure, dates, completion_rate, f'{habit_name} Completion Rate',
+                   f'{habit_name} Completion Rate Over Time', color='red')
+        plt.show()
+        plt.close(figure)
+
+        return True
+
+    def build_graph_all(self):
+        """
+        This method build a graph from overall habit data and shows the completion rate over time. Again, the x-axis
+        represents dates, while the y-axis represents habit completion rate (calculated as ALL completed habit dates
+        divided by ALL stored dates: both completed and not completed).
+        """
+        dates, completion_rate = self.completion_rate_all()
+        plt = pyplot()
+        figure = plt.figure()
+        draw_graph(figure, dates, completion_rate, 'Average Completion Rate',
+                   'Average Completion Rate Over Time for All Habits')
         plt.show()
+        plt.close(figure)
+
+    def render_all(self, graph_dir=GRAPH_DIR, processes=None):
+        """
+        Renders the graphs of all habits and the overall graph into PNG files in one pass, using a pool of processes.
+        The file names contain a hash of the plotted data (for the overall graph, a hash of the hashes of all habits),
+        so a graph is only rendered again after its data has changed, and a habit that was deleted and added again
+        never gets the graph of the deleted one. Graphs of older data and of deleted habits are removed. Returns the
+        paths of the newly rendered graphs.
+        """
+        os.makedirs(graph_dir, exist_ok=True)
+        jobs = []
+        paths = set()
+        keys = []
+        for habit_name in self.storage.view_all_habits():
+            graph = self.completion_rate_one(habit_name)
+            if graph is None:
+                continue
+            key = graph_key(*graph)
+            keys.append(f'{habit_name}:{key}')
+            name = quote(habit_name, safe='').replace('-', '%2D')
+            path = os.path.join(graph_dir, f'{name}-{key}.png')
+            paths.add(path)
+            if not os.path.exists(path):
+                jobs.append((path, *graph, f'{habit_name} Completion Rate', f'{habit_name} Completion Rate Over Time',
+                             'red'))
+
+        # the habit names are quoted, including the "-" before the hash, so no habit graph starts with "%all-"
+        all_key = hashlib.sha1('\n'.join(keys).encode()).hexdigest()[:16]
+        path = os.path.join(graph_dir, f'%all-{all_key}.png')
+        paths.add(path)
+        if not os.path.exists(path):
+            jobs.append((path, *self.completion_rate_all(), 'Average Completion Rate',
+                         'Average Completion Rate Over Time for All Habits', None))
+        remove_old_graphs(graph_dir, paths)
+
+        if len(jobs) > 1:
+            with ProcessPoolExecutor(processes) as pool:
+                list(pool.map(render_graph, *zip(*jobs)))
+        elif jobs:
+            render_graph(*jobs[0])
+        return [job[0] for job in jobs]
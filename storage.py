@@ -0,0 +1,283 @@
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+
+# A write that lost the race for a habit is retried at most MAX_RETRIES times. Before each retry the writer waits a
+# random time of up to BACKOFF * 2^attempt seconds, so that competing writers spread out.
+MAX_RETRIES = 10
+BACKOFF = 0.01
+
+# Seconds that the writes of the current thread spent backing off from other writers and waiting for the write lock of
+# the storage, in the attribute "seconds" of each. The load test (loadtest.py) reports both.
+backoff_time = threading.local()
+lock_wait_time = threading.local()
+
+# The test data covers a period of 4 weeks. The habits are stored with the streaks that result from their events as
+# (habit_name, habit_date, periodicity, task_specification, current_streak, longest_streak, broken_streak) and the
+# events as (habit_name, completed_date, not_completed_date, last_update).
+TEST_HABITS = [
+    ("clean", "24.01.2024", "weekly", "Clean the apartment", 5, 5, 0),
+    ("finance", "21.01.2024", "monthly", "Review and plan your expenses", 2, 2, 0),
+    ("goals", "26.01.2024", "monthly", "Write down your current goals", 1, 1, 0),
+    ("no phone", "24.01.2024", "weekly", "Do not use the phone for the entire day", 0, 1, 4),
+    ("read", "28.01.2024", "daily", "Read at least 30 minutes per day", 0, 15, 9),
+]
+TEST_EVENTS = [
+    ("clean", "24.01.2024", None, "24.01.2024"),
+    ("clean", "31.01.2024", None, "31.02.2024"),
+    ("clean", "07.02.2024", None, "07.02.2024"),
+    ("clean", "14.02.2024", None, "14.02.2024"),
+    ("clean", "21.02.2024", None, "21.02.2024"),
+    ("finance", "21.01.2024", None, "21.01.2024"),
+    ("finance", "22.02.2024", None, "22.02.2024"),
+    ("goals", "26.01.2024", None, "26.01.2024"),
+    ("goals", "26.02.2024", None, "26.02.2024"),
+    ("no phone", "25.01.2024", None, "25.01.2024"),
+    ("no phone", None, "01.02.2024", "25.01.2024"),
+    ("no phone", None, "08.02.2024", "25.01.2024"),
+    ("no phone", None, "15.02.2024", "25.01.2024"),
+    ("no phone", None, "22.02.2024", "25.01.2024"),
+    ("read", None, "28.01.2024", "28.01.2024"),
+    ("read", None, "29.01.2024", "28.01.2024"),
+    ("read", "30.01.2024", None, "30.01.2024"),
+    ("read", None, "31.01.2024", "30.01.2024"),
+] + [
+    ("read", f"{day:02}.02.2024", None, f"{day:02}.02.2024") for day in range(1, 16)
+] + [
+    ("read", None, f"{day:02}.02.2024", "15.02.2024") for day in [16] + list(range(18, 26))
+]
+
+
+class ConflictError(Exception):
+    """
+    Raised if a habit keeps being changed by other writers and a write can't be stored after MAX_RETRIES attempts.
+    """
+
+
+class HabitExistsError(Exception):
+    """
+    Raised if a habit is added with the name of an existing habit.
+    """
+
+
+def retry(operation):
+    """
+    Runs the operation until it returns True, backing off between the attempts. The operation returns False if its
+    compare-and-swap write found the habit changed by another writer.
+    """
+    for attempt in range(MAX_RETRIES):
+        if operation():
+            return
+        delay = random.uniform(0, BACKOFF * 2 ** attempt)
+        backoff_time.seconds = getattr(backoff_time, 'seconds', 0) + delay
+        time.sleep(delay)
+    raise ConflictError(f"The habit was changed by other writers {MAX_RETRIES} times in a row.")
+
+
+def record_lock_wait(start):
+    """
+    Adds the time since start (a time.perf_counter() value taken before waiting for the write lock) to the lock-wait
+    time of the current thread.
+    """
+    lock_wait_time.seconds = getattr(lock_wait_time, 'seconds', 0) + time.perf_counter() - start
+
+
+def parse_date(date):
+    """
+    Converts a date stored as "dd.mm.yyyy" into a datetime. Dates written by older versions are quoted.
+    """
+    return datetime.strptime(date.strip('"'), "%d.%m.%Y")
+
+
+def apply_event(habit, completed_date, not_completed_date, last_update):
+    """
+    Applies one log event to the habit: a completed period extends the current streak and is marked in the calendar,
+    a missed period breaks the streak. Both update the transition counts of the habit's forecast model.
+    """
+    habit.record_outcome(bool(completed_date))
+    if completed_date:
+        habit.current_streak += 1
+        habit.broken_streak = 0
+        habit.longest_streak = max(habit.current_streak, habit.longest_streak)
+        habit.completed_date = completed_date
+        habit.mark_completed(parse_date(completed_date).date())
+    else:
+        habit.current_streak = 0
+        habit.broken_streak += 1
+        habit.not_completed_date = not_completed_date
+    habit.last_update = last_update
+
+
+def count_transitions(outcomes):
+    """
+    Counts the transitions between the outcomes (True for completed) of consecutive periods, in the order of
+    Habit.transitions.
+    """
+    transitions = [0, 0, 0, 0]
+    for previous, completed in zip(outcomes, outcomes[1:]):
+        transitions[2 * previous + completed] += 1
+    return tuple(transitions)
+
+
+class Storage(ABC):
+    """
+    The interface between the habit tracker and the place where its data is kept. HabitTracker, Habit and Statistics
+    only talk to a Storage, so the same code runs on the SQLite database (database.SQLiteStorage) and on the in-memory
+    engine (memory.MemoryStorage).
+
+    Every habit has a log of completed and missed periods and a version that each logged event increases. Events are
+    only logged through append_event, which is a compare-and-swap on the version.
+
+    A storage implements all abstract methods, the roll-over and check-off methods are built on top of them.
+    """
+
+    # the day on which roll_over_once last logged the missed periods of all habits
+    rolled_over_on = None
+
+    @abstractmethod
+    def create_table(self):
+        """
+        Creates the store for habits and their events if it doesn't exist yet. An existing store keeps its data.
+        """
+
+    @abstractmethod
+    def clear(self):
+        """
+        Deletes all habits and their events.
+        """
+
+    @abstractmethod
+    def add_test_data(self):
+        """
+        Adds TEST_HABITS and TEST_EVENTS to the store if it has no habits yet, otherwise the store is left as it is.
+        """
+
+    @abstractmethod
+    def add_habit(self, habit):
+        """
+        Adds a new habit to the store. Raises HabitExistsError if a habit with the same name exists already, whose
+        events are kept.
+        """
+
+    @abstractmethod
+    def delete_habit(self, habit_name):
+        """
+        Deletes a habit and all of its events.
+        """
+
+    @abstractmethod
+    def append_event(self, habit_name, version, completed_date, not_completed_date, last_update):
+        """
+        Logs a completed or missed period of the habit, but only if the habit is still at the given version. Returns
+        True if the event was logged.
+        """
+
+    @abstractmethod
+    def compact_log(self):
+        """
+        Folds the logged events into the stored snapshots of the habits.
+        """
+
+    @abstractmethod
+    def view_all_habits(self):
+        """
+        Retrieves a sorted list of all habit names.
+        """
+
+    @abstractmethod
+    def view_all_info(self):
+        """
+        Retrieves the current state of all habits as Habit objects.
+        """
+
+    @abstractmethod
+    def view_habit(self, habit_name):
+        """
+        Retrieves the current state of one habit, or None if no habit with this name exists.
+        """
+
+    @abstractmethod
+    def view_same_periodicity(self, periodicity):
+        """
+        Retrieves a sorted list of the names of all habits with the given periodicity.
+        """
+
+    @abstractmethod
+    def view_longest_streak(self):
+        """
+        Retrieves the name and the longest streak of the habit with the longest streak, or None if no habit has been
+        completed yet.
+        """
+
+    @abstractmethod
+    def view_broken_streak(self):
+        """
+        Retrieves the name and the broken streak of the habit with the biggest broken streak, or None if no habit has
+        been skipped yet.
+        """
+
+    @abstractmethod
+    def view_dates(self, habit_name=None):
+        """
+        Retrieves two lists with the dates (as datetimes) of all completed and all not completed periods of one habit,
+        or of all habits if no name is given.
+        """
+
+    def update_habits(self):
+        """
+        Updates habits. If the habit is not marked completed (checked off) in its respective period (day, week, or
+        month), the habit streak is broken, current streak is set to 0 and the date is stored as the day when a habit
+        was not done. A missed period is logged at most once per day.
+        """
+        for habit_name in self.view_all_habits():
+            retry(lambda: self.roll_over(habit_name))
+
+    def roll_over_once(self):
+        """
+        Runs update_habits when the habits are first needed on a day, instead of every time the program starts or a
+        habit is checked off.
+        """
+        today = datetime.now().date()
+        if self.rolled_over_on != today:
+            self.update_habits()
+            self.rolled_over_on = today
+
+    def roll_over(self, habit_name):
+        """
+        Logs a missed period for the habit if it was not completed in time. Returns False if the habit was changed by
+        another writer in the meantime.
+        """
+        today = datetime.now()
+        today_str = today.strftime("%d.%m.%Y")
+
+        habit = self.view_habit(habit_name)
+        if habit is None or habit.not_completed_date == today_str:
+            return True
+
+        if habit.periodicity == 'daily':
+            period = timedelta(days=1)
+        elif habit.periodicity == 'weekly':
+            period = timedelta(weeks=1)
+        elif habit.periodicity == 'monthly':
+            period = timedelta(days=30)
+
+        # Check if last completed date is beyond the period
+        if habit.last_update is not None:
+            last_update = parse_date(habit.last_update)
+        else:
+            # if a habit is new, the last_update is set to None. In this case, not completed habit periods are counted
+            # from the habit creation date.
+            last_update = parse_date(habit.habit_date)
+
+        if today - last_update > period:
+            return self.append_event(habit_name, habit.version, None, today_str, habit.last_update)
+        return True
+
+    def check_habit_off(self, habit_name, completed_date, last_update, version):
+        """
+        Logs a completed period of the habit. Returns False without logging anything if the habit is no longer at the
+        given version.
+        """
+        return self.append_event(habit_name, version, completed_date, None, last_update)
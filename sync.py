@@ -0,0 +1,39 @@
+import os
+import sys
+
+import database
+
+# number of changes that are transferred and applied in one transaction
+SYNC_BATCH = 500
+
+
+def sync(source, target, batch=SYNC_BATCH):
+    """
+    Brings the target SQLiteStorage up to date with the source one by applying the changes of the source's change
+    feed that the target hasn't received yet, batch by batch. Only rows that changed since the last sync are copied.
+    Returns the number of applied changes.
+
+    The sync goes in one direction: the target is a replica of the source and its own habits are overwritten by those
+    of the source. The copied events get ids of the target and are kept apart from the events logged in the target
+    itself, which are dropped when the source's version of their habit arrives. Events that were moved into the archive
+    of the source before the first sync are not transferred.
+    """
+    target.create_table()
+    source_name = os.path.abspath(source.path)
+    seq = target.sync_position(source_name)
+    applied = 0
+    while True:
+        changes = source.changes_since(seq, batch)
+        if not changes:
+            return applied
+        target.apply_changes(source_name, changes)
+        seq = changes[-1][0]
+        applied += len(changes)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python sync.py SOURCE_DATABASE TARGET_DATABASE")
+        sys.exit(2)
+    applied = sync(database.SQLiteStorage(sys.argv[1]), database.SQLiteStorage(sys.argv[2]))
+    print(f"Applied {applied} changes.")
@@ -1,18 +1,42 @@
+import multiprocessing
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import archive
 import database
+import loadtest
+import query_plan
+import storage as storage_module
+import sync
+from memory import MemoryStorage
 from tracking import HabitTracker
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 # All the main methods are tested in this file. However, some methods were skipped for efficiency, since
 # their code is almost identical to the other methods that passed the test (e.g., longest_streak_habit and
-# broken_streak_habit).
+# broken_streak_habit). The tests run on the in-memory storage, only the tests of SQLite features use a database
+# file in a temporary directory.
+
+storage = MemoryStorage()
+
+# upper limit in microseconds for importing the modules that main.py loads at startup (measured with -X importtime)
+STARTUP_IMPORT_BUDGET = 100_000
+
 
 def test_check_habit_off():
-    database.create_table()
-    database.add_test_data()
+    storage.clear()
+    storage.add_test_data()
 
-    HabitTracker().check_habit_off("read")
-    all_habits = database.view_all_info()
+    HabitTracker(storage).check_habit_off("read")
+    all_habits = storage.view_all_info()
     today = datetime.now().date()
 
     for habit in all_habits:
@@ -27,52 +51,551 @@ def test_check_habit_off():
 
 
 def test_add_habit():
-    database.create_table()
-    HabitTracker().add_habit("test_habit", "daily", "Test habit description")
-    current_habits = database.view_all_habits()
+    storage.clear()
+    HabitTracker(storage).add_habit("test_habit", "daily", "Test habit description")
+    current_habits = storage.view_all_habits()
     assert "test_habit" in current_habits
 
 
+def test_add_existing_habit(tmp_path):
+    sqlite_storage = database.SQLiteStorage(tmp_path / 'HabitTracker.db')
+    sqlite_storage.create_table()
+    for habit_storage in storage, sqlite_storage:
+        habit_storage.clear()
+        habit_storage.add_test_data()
+        tracker = HabitTracker(habit_storage)
+        read_habit = habit_storage.view_habit("read")
+        with pytest.raises(storage_module.HabitExistsError):
+            habit_storage.add_habit(read_habit)
+
+        # both storages keep the existing habit and its events
+        tracker.add_habit("read", "weekly", "Read a book")
+        assert vars(habit_storage.view_habit("read")) == vars(read_habit)
+        assert len(habit_storage.view_dates("read")[0]) == 16
+
+
 def test_delete_habit():
-    database.create_table()
-    HabitTracker().delete_habit("read")
-    current_habits = database.view_all_habits()
+    storage.clear()
+    HabitTracker(storage).delete_habit("read")
+    current_habits = storage.view_all_habits()
     assert "read" not in current_habits
 
 
 def test_get_current_habits():
-    database.create_table()
-    database.add_test_data()
-    current_habits = database.view_all_habits()
+    storage.clear()
+    storage.add_test_data()
+    current_habits = storage.view_all_habits()
     assert current_habits == ["clean", "finance", "goals", "no phone", "read"]
 
 
 def test_longest_streak_overall():
-    database.create_table()
-    database.add_test_data()
-    longest_streak_habit, longest_streak = HabitTracker().longest_streak_overall()
+    storage.clear()
+    storage.add_test_data()
+    longest_streak_habit, longest_streak = HabitTracker(storage).longest_streak_overall()
 
     assert longest_streak_habit == 'read', longest_streak == 15
 
 
 def test_longest_streak_habit():
-    habit_name, habit_longest_streak = HabitTracker().longest_streak_one("clean")
+    habit_name, habit_longest_streak = HabitTracker(storage).longest_streak_one("clean")
     assert habit_longest_streak == 5
 
 
 def test_broken_streak_overall():
-    database.create_table()
-    database.add_test_data()
-    broken_streak_habit, broken_streak = HabitTracker().broken_streak_overall()
+    storage.clear()
+    storage.add_test_data()
+    broken_streak_habit, broken_streak = HabitTracker(storage).broken_streak_overall()
 
     assert broken_streak_habit == 'read', broken_streak == 10
 
 
 def test_get_one_habit():
-    HabitTracker().get_one_habit("wash")
+    HabitTracker(storage).get_one_habit("wash")
     assert "Sorry, a habit with this name doesn't exists. Please try again."
 
 
 def test_get_same_periodicity():
-    result = HabitTracker().get_same_periodicity(p='monthly')
+    result = HabitTracker(storage).get_same_periodicity(p='monthly')
     assert "finance", "goals" in result
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    assert query_plan.audit() == []
+
+    # the audit covers the statements that the storage API actually sends, including the test data, the migrations
+    # and the statements of the triggers
+    statements = query_plan.collect_statements(tmp_path)
+    db = sqlite3.connect(tmp_path / 'HabitTracker.db')
+    statements.update(query_plan.trigger_statements(db.cursor()))
+    db.close()
+    locations = set(statements.values())
+    assert {"database.insert_habits", "database.convert_legacy_tables", "database.migrate_sync_state",
+            "database.store_task_specification", "trigger dates_insert_change"} <= locations
+    assert any(query.startswith("INSERT OR IGNORE INTO task_specs") for query in statements)
+    assert not any(query.startswith(("BEGIN", "PRAGMA", "CREATE")) for query in statements)
+
+    # walking a whole index is a full scan, unless a LIMIT stops it early
+    query = "SELECT habit_name FROM habits ORDER BY habit_name"
+    assert query_plan.is_full_scan("SCAN habits USING COVERING INDEX sqlite_autoindex_habits_1", query)
+    assert not query_plan.is_full_scan("SCAN habits USING COVERING INDEX sqlite_autoindex_habits_1", query + " LIMIT 1")
+    assert query_plan.is_full_scan("SCAN habits", query + " LIMIT 1")
+    assert not query_plan.is_full_scan("SEARCH habits USING INDEX idx_habits_periodicity (periodicity=?)", query)
+
+
+def test_event_log_and_compaction(tmp_path):
+    sqlite_storage = database.SQLiteStorage(tmp_path / 'HabitTracker.db')
+    sqlite_storage.create_table()
+    sqlite_storage.add_test_data()
+    logged_events = database_rows(sqlite_storage, "read")
+    HabitTracker(sqlite_storage).check_habit_off("read")
+
+    # the missed day and the check-off are appended to the log instead of overwriting the history of the habit
+    assert database_rows(sqlite_storage, "read")[:len(logged_events)] == logged_events
+    assert len(database_rows(sqlite_storage, "read")) == len(logged_events) + 2
+
+    before = [vars(habit) for habit in sqlite_storage.view_all_info()]
+    sqlite_storage.compact_log()
+    after = [vars(habit) for habit in sqlite_storage.view_all_info()]
+    for habit in after:
+        assert habit["snapshot_event"] == max(event[2] for event in database_rows(sqlite_storage, habit["habit_name"]))
+    assert before == after
+
+
+def test_streaks_without_compaction(tmp_path):
+    sqlite_storage = database.SQLiteStorage(tmp_path / 'HabitTracker.db')
+    sqlite_storage.create_table()
+    sqlite_storage.add_test_data()
+    memory_storage = MemoryStorage()
+    memory_storage.add_test_data()
+    for habit_storage in sqlite_storage, memory_storage:
+        HabitTracker(habit_storage).check_habit_off("read")
+
+    # the streaks are current without compacting the log, so the queries only read and answer while another
+    # connection holds the write lock
+    writer = sqlite_storage.connect()
+    writer.execute("BEGIN IMMEDIATE")
+    assert sqlite_storage.view_longest_streak() == memory_storage.view_longest_streak()
+    assert sqlite_storage.view_broken_streak() == memory_storage.view_broken_streak()
+    writer.rollback()
+    writer.close()
+    assert sqlite_storage.view_habit("read").current_streak == 1
+
+
+def test_archive_events(tmp_path):
+    sqlite_storage = database.SQLiteStorage(tmp_path / 'HabitTracker.db')
+    sqlite_storage.create_table()
+    sqlite_storage.add_test_data()
+    before = [vars(habit) for habit in sqlite_storage.view_all_info()]
+    dates_before = sqlite_storage.view_dates("read")
+    read_events = database_rows(sqlite_storage, "read")
+
+    # an interrupted run wrote the first events of read into the archive, but didn't delete them from the log
+    first_events = read_events[:3]
+    archive.append_archive(sqlite_storage.archive_dir, "read",
+                           [(database.parse_date(completed or missed).toordinal(), completed is not None)
+                            for completed, missed, event_id in first_events], first_events[-1][2])
+    assert [sorted(dates) for dates in sqlite_storage.view_dates("read")] == [sorted(dates) for dates in dates_before]
+
+    # all test data is older than today, so everything is moved into the archive
+    logged = sum(len(database_rows(sqlite_storage, habit_name)) for habit_name in sqlite_storage.view_all_habits())
+    assert archive.archive_events(sqlite_storage, horizon=timedelta(days=0)) == logged - len(first_events)
+    assert database_rows(sqlite_storage, "read") == []
+    completed_dates, not_completed_dates, last_archived = archive.archived_dates(sqlite_storage.archive_dir, "read")
+    assert len(completed_dates) == len([event for event in read_events if event[0] is not None])
+    assert len(not_completed_dates) == len([event for event in read_events if event[1] is not None])
+    assert datetime(2024, 2, 15) in completed_dates and datetime(2024, 2, 25) in not_completed_dates
+    assert last_archived == read_events[-1][2]
+    assert [vars(habit) for habit in sqlite_storage.view_all_info()] == before
+    assert [sorted(dates) for dates in sqlite_storage.view_dates("read")] == [sorted(dates) for dates in dates_before]
+
+    # the ordinals are stored little-endian after the 16-byte header of the first segment
+    with open(archive.archive_path(sqlite_storage.archive_dir, "read"), 'rb') as file:
+        data = file.read()
+    first_date = database.parse_date(first_events[0][0] or first_events[0][1])
+    assert data[16:20] == first_date.toordinal().to_bytes(4, 'little')
+
+    # a later run only appends a segment with the newly archived events (the missed day and today's check-off)
+    HabitTracker(sqlite_storage).check_habit_off("read")
+    archive.archive_events(sqlite_storage, horizon=timedelta(days=-1))
+    assert database_rows(sqlite_storage, "read") == []
+    with open(archive.archive_path(sqlite_storage.archive_dir, "read"), 'rb') as file:
+        appended = file.read()
+    assert appended.startswith(data) and len(appended) == len(data) + 16 + 2 * 4 + 4
+
+
+def test_completion_calendar():
+    storage.clear()
+    storage.add_test_data()
+    read_habit = HabitTracker(storage).get_one_habit("read")
+
+    # read was created on 28.01.2024 and completed on 30.01.2024 and from 01.02.2024 to 15.02.2024
+    assert read_habit.calendar == 0b1111111111111110100
+    assert read_habit.streak_lengths() == [1, 15]
+    assert read_habit.completed_periods(0, 29) == 16
+    assert read_habit.completed_periods(19, 29) == 0
+    assert read_habit.completion_rate(0, 4) == 0.25
+
+    HabitTracker(storage).check_habit_off("read")
+    today = read_habit.period_index(datetime.now().date())
+    assert HabitTracker(storage).get_one_habit("read").calendar == read_habit.calendar | 1 << today
+
+
+def test_concurrent_check_off(tmp_path):
+    sqlite_storage = database.SQLiteStorage(tmp_path / 'HabitTracker.db')
+    sqlite_storage.create_table()
+    sqlite_storage.add_test_data()
+    with multiprocessing.Pool(4) as pool:
+        pool.map(check_off_read, [sqlite_storage.path] * 8)
+
+    # every process tries to check off read, but only one completion may be logged for today
+    today = datetime.now().strftime("%d.%m.%Y")
+    assert [event[0] for event in database_rows(sqlite_storage, "read")].count(today) == 1
+    read_habit = sqlite_storage.view_habit("read")
+    assert read_habit.current_streak == 1 and read_habit.broken_streak == 0
+
+    # a write based on an outdated version of the habit is rejected
+    assert not sqlite_storage.check_habit_off("read", today, today, read_habit.version - 1)
+
+
+def test_concurrent_start(tmp_path):
+    # several instances of the app start on the same new database, each creates the tables and adds the test data
+    for run in range(5):
+        path = str(tmp_path / f'{run}.db')
+        with multiprocessing.Pool(4) as pool:
+            pool.map(start_up, [path] * 4)
+        sqlite_storage = database.SQLiteStorage(path)
+        assert sqlite_storage.view_all_habits() == ["clean", "finance", "goals", "no phone", "read"]
+        assert len(database_rows(sqlite_storage, "read")) == 28
+
+
+def test_storages_agree(tmp_path):
+    sqlite_storage = database.SQLiteStorage(tmp_path / 'HabitTracker.db')
+    memory_storage = MemoryStorage()
+    for habit_storage in sqlite_storage, memory_storage:
+        habit_storage.create_table()
+        habit_storage.add_test_data()
+        HabitTracker(habit_storage).check_habit_off("read")
+        HabitTracker(habit_storage).add_habit("test_habit", "daily", "Test habit description")
+        HabitTracker(habit_storage).delete_habit("goals")
+
+    assert sqlite_storage.view_all_habits() == memory_storage.view_all_habits()
+    assert HabitTracker(sqlite_storage).broken_streak_overall() == HabitTracker(memory_storage).broken_streak_overall()
+    assert [sorted(dates) for dates in sqlite_storage.view_dates()] == \
+           [sorted(dates) for dates in memory_storage.view_dates()]
+    for sqlite_habit, memory_habit in zip(sqlite_storage.view_all_info(), memory_storage.view_all_info()):
+        assert sqlite_habit.habit_name == memory_habit.habit_name
+        assert sqlite_habit.current_streak == memory_habit.current_streak
+        assert sqlite_habit.broken_streak == memory_habit.broken_streak
+        assert sqlite_habit.calendar == memory_habit.calendar
+        assert sqlite_habit.transitions == memory_habit.transitions
+        assert sqlite_habit.version == memory_habit.version
+
+
+def test_memory_snapshot(tmp_path):
+    memory_storage = MemoryStorage(str(tmp_path / 'HabitTracker.json'))
+    memory_storage.create_table()
+    memory_storage.add_test_data()
+    HabitTracker(memory_storage).check_habit_off("read")
+    memory_storage.compact_log()
+
+    restored_storage = MemoryStorage(str(tmp_path / 'HabitTracker.json'))
+    assert [vars(habit) for habit in restored_storage.view_all_info()] == \
+           [vars(habit) for habit in memory_storage.view_all_info()]
+    assert restored_storage.view_dates() == memory_storage.view_dates()
+
+
+def check_off_read(path):
+    HabitTracker(database.SQLiteStorage(path)).check_habit_off("read")
+
+
+def start_up(path):
+    # the database calls of main.py at startup
+    sqlite_storage = database.SQLiteStorage(path)
+    sqlite_storage.create_table()
+    sqlite_storage.add_test_data()
+
+
+def habit_states(habit_storage):
+    # the states of all habits, without the ids of their task specifications and last events, which differ between a
+    # source and its replica
+    return [{name: value for name, value in vars(habit).items() if name not in ('spec_id', 'snapshot_event')}
+            for habit in sorted(habit_storage.view_all_info(), key=lambda habit: habit.habit_name)]
+
+
+def database_rows(sqlite_storage, habit_name):
+    db = sqlite_storage.connect()
+    rows = db.execute("SELECT completed_date, not_completed_date, event_id FROM dates WHERE habit_name = ?",
+                      (habit_name,)).fetchall()
+    db.close()
+    return rows
+
+
+def test_render_all(tmp_path):
+    pytest.importorskip("matplotlib")
+    from statistics import Statistics
+
+    memory_storage = MemoryStorage()
+    memory_storage.add_test_data()
+    # the missed periods up to today are logged first, so that only the check-offs below change the habits
+    memory_storage.update_habits()
+    graph_dir = str(tmp_path / 'graphs')
+    assert len(Statistics(memory_storage).render_all(graph_dir, processes=2)) == 6
+    assert Statistics(memory_storage).render_all(graph_dir) == []
+
+    HabitTracker(memory_storage).check_habit_off("no phone")
+    rendered = Statistics(memory_storage).render_all(graph_dir)
+    assert len(rendered) == 2 and any('no%20phone' in path for path in rendered)
+    assert len(os.listdir(graph_dir)) == 6
+
+    # a habit that is deleted and added again on the same day gets a new graph, and deleted habits lose theirs
+    tracker = HabitTracker(memory_storage)
+    tracker.delete_habit("goals")
+    tracker.delete_habit("read")
+    tracker.add_habit("read", "daily", "Read a book")
+    tracker.check_habit_off("read")
+    rendered = Statistics(memory_storage).render_all(graph_dir)
+    assert len(rendered) == 2 and any(os.path.basename(path).startswith('read-') for path in rendered)
+    assert sorted(name.split('-')[0] for name in os.listdir(graph_dir)) == ['%all', 'clean', 'finance', 'no%20phone',
+                                                                            'read']
+
+
+def test_fast_startup(tmp_path):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import archive, database, tracking'],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+    imports = [line.split('|') for line in result.stderr.splitlines() if line.startswith('import time:')][1:]
+    # the modules imported at the top level have no indentation, their cumulative times add up to the whole startup
+    assert sum(int(cumulative) for _, cumulative, name in imports if not name[1:].startswith(' ')) \
+           < STARTUP_IMPORT_BUDGET
+    assert not any(name.strip().startswith('matplotlib') for _, _, name in imports)
+
+    sqlite_storage = database.SQLiteStorage(str(tmp_path / 'HabitTracker.db'))
+    sqlite_storage.create_table()
+    sqlite_storage.add_test_data()
+    sqlite_storage.create_table()
+    assert sqlite_storage.view_all_habits() == ["clean", "finance", "goals", "no phone", "read"]
+
+    sqlite_storage.clear()
+    assert sqlite_storage.view_all_habits() == []
+
+
+def write_baseline_database(path, today):
+    """
+    Writes a database with the statements of the app before the layout versions: main.py created the tables, added the
+    test data and ran update_habits, which set the not completed date of all dates rows of the overdue habits. Then a
+    new habit was added and "read" checked off, which ran update_habits again and overwrote all dates rows of the
+    habit, JSON-encoding the stored not completed date once more every time.
+    """
+    db = sqlite3.connect(path)
+    db.execute("""CREATE TABLE habits (habit_name TEXT NOT NULL PRIMARY KEY, habit_date TEXT NOT NULL, periodicity TEXT,
+                task_specification TEXT, current_streak INTEGER, longest_streak INTEGER, broken_streak INTEGER)""")
+    db.execute("""CREATE TABLE dates (habit_name TEXT NOT NULL, completed_date text array TEXT,
+                not_completed_date text array TEXT, last_update TEXT)""")
+    db.executemany("INSERT INTO habits VALUES (?, ?, ?, ?, ?, ?, ?)", storage_module.TEST_HABITS)
+    db.executemany("INSERT INTO dates VALUES (?, ?, ?, ?)", storage_module.TEST_EVENTS)
+    for habit_name, *_ in storage_module.TEST_HABITS:
+        db.execute("UPDATE habits SET current_streak = 0, broken_streak = broken_streak + 1 WHERE habit_name = ?",
+                   (habit_name,))
+        db.execute("UPDATE dates SET not_completed_date = ? WHERE habit_name = ?", (json.dumps(today), habit_name))
+    db.execute("INSERT INTO habits VALUES (?, ?, ?, ?, ?, ?, ?)", ("walk", today, "weekly", "Go for a walk", 0, 0, 0))
+    db.execute("INSERT INTO dates VALUES (?, ?, ?, ?)", ("walk", json.dumps([]), json.dumps([]), None))
+    stored_date = db.execute("SELECT not_completed_date FROM dates WHERE habit_name = 'read'").fetchone()[0]
+    db.execute("UPDATE habits SET current_streak = 1, broken_streak = 0 WHERE habit_name = 'read'")
+    db.execute("UPDATE dates SET completed_date = ?, not_completed_date = ?, last_update = ? WHERE habit_name = 'read'",
+               (json.dumps(today), json.dumps(json.dumps(stored_date)), today))
+    db.commit()
+    db.close()
+
+
+def test_convert_unversioned_database(tmp_path):
+    today = datetime.now().strftime("%d.%m.%Y")
+    write_baseline_database(tmp_path / 'HabitTracker.db', today)
+
+    sqlite_storage = database.SQLiteStorage(tmp_path / 'HabitTracker.db')
+    sqlite_storage.create_table()
+    assert sqlite_storage.view_all_habits() == ["clean", "finance", "goals", "no phone", "read", "walk"]
+
+    # the 28 identical rows of "read" are one missed and one completed period of today
+    read_habit = sqlite_storage.view_habit("read")
+    assert (read_habit.current_streak, read_habit.longest_streak, read_habit.broken_streak) == (1, 15, 0)
+    assert read_habit.periodicity == "daily" and read_habit.task_specification == "Read at least 30 minutes per day"
+    assert read_habit.completed_date == today and read_habit.not_completed_date == today
+    assert read_habit.calendar >> read_habit.period_index(datetime.now().date()) == 1
+    assert read_habit.transitions == (0, 1, 0, 0)
+    assert sqlite_storage.view_dates("read") == ([datetime.strptime(today, "%d.%m.%Y")],) * 2
+
+    # the completed dates of the other habits survived, their not completed dates were all overwritten with today
+    completed_dates, not_completed_dates = sqlite_storage.view_dates("clean")
+    assert len(completed_dates) == 5 and not_completed_dates == [datetime.strptime(today, "%d.%m.%Y")]
+    assert sqlite_storage.view_habit("clean").transitions == (0, 0, 1, 4)
+    assert sqlite_storage.view_dates("walk") == ([], [])
+    assert len(sqlite_storage.changes_since(0)) == 6 + 16
+
+    # the statistics read the dates of all habits
+    from statistics import Statistics
+    Statistics(sqlite_storage).completion_rate_all()
+
+
+def test_analytics():
+    np = pytest.importorskip("numpy")
+    from analytics import Analytics
+
+    memory_storage = MemoryStorage()
+    memory_storage.add_test_data()
+    analytics = Analytics(memory_storage)
+    read = analytics.habit_names.index("read")
+
+    co_completion = analytics.co_completion()
+    assert co_completion[read, read] == analytics.matrix[read].sum() == 16
+    assert (co_completion == co_completion.T).all()
+
+    # a habit only counts from the day of its creation, and a weekly habit counts as done on all days of a done week
+    assert not analytics.matrix[~analytics.active].any()
+    assert analytics.active[read].argmax() == (datetime(2024, 1, 28) - datetime(2024, 1, 21)).days
+    clean = analytics.habit_names.index("clean")
+    assert analytics.period_matrix[clean].sum() == 7 * analytics.matrix[clean].sum() == 35
+
+    correlation = analytics.correlation()
+    assert np.allclose(correlation, correlation.T)
+    assert np.allclose(np.diag(correlation), 1)
+    both_active = analytics.active[read] & analytics.active[clean]
+    assert np.isclose(correlation[read, clean], np.corrcoef(analytics.period_matrix[read][both_active],
+                                                            analytics.period_matrix[clean][both_active])[0, 1])
+
+    assert analytics.lift().shape == (5, 5)
+    weekdays = (analytics.days.astype(np.int64) + 3) % 7
+    read_days = analytics.matrix[read][analytics.active[read]]
+    assert np.allclose(analytics.weekday_profile()[read],
+                       [read_days[weekdays[analytics.active[read]] == weekday].mean() for weekday in range(7)])
+    assert analytics.seasonality_profile().shape == (5, 12)
+
+
+def test_sync(tmp_path):
+    source = database.SQLiteStorage(str(tmp_path / 'HabitTracker.db'))
+    source.create_table()
+    source.add_test_data()
+    os.mkdir(tmp_path / 'replica')
+    replica = database.SQLiteStorage(str(tmp_path / 'replica' / 'HabitTracker.db'))
+    assert sync.sync(source, replica, batch=7) == len(source.changes_since(0))
+
+    HabitTracker(source).check_habit_off("read")
+    HabitTracker(source).delete_habit("goals")
+    HabitTracker(source).add_habit("goals", "daily", "Test habit description")
+    seq = replica.sync_position(os.path.abspath(source.path))
+    # only the changed habits and the new events are transferred
+    assert 0 < sync.sync(source, replica, batch=4) == len(source.changes_since(seq)) < len(source.changes_since(0))
+    assert sync.sync(source, replica) == 0
+
+    assert habit_states(source) == habit_states(replica)
+    assert [sorted(dates) for dates in source.view_dates()] == [sorted(dates) for dates in replica.view_dates()]
+
+
+def test_sync_with_replica_events(tmp_path):
+    source = database.SQLiteStorage(str(tmp_path / 'HabitTracker.db'))
+    source.create_table()
+    os.mkdir(tmp_path / 'replica')
+    replica = database.SQLiteStorage(str(tmp_path / 'replica' / 'HabitTracker.db'))
+    replica.create_table()
+
+    # both databases log events with the same ids before the first sync
+    HabitTracker(source).add_habit("run", "daily", "Go for a run")
+    HabitTracker(source).check_habit_off("run")
+    HabitTracker(replica).add_habit("swim", "daily", "Go swimming")
+    HabitTracker(replica).check_habit_off("swim")
+    assert sync.sync(source, replica) == 2
+
+    assert replica.view_all_habits() == ["run", "swim"]
+    assert replica.view_dates("run") == source.view_dates("run")
+    assert replica.view_habit("run").current_streak == 1 and replica.view_habit("swim").current_streak == 1
+    assert habit_states(replica)[:1] == habit_states(source)
+
+    # later events of the source are replayed on top of the copied snapshot
+    source.compact_log()
+    source.append_event("run", source.view_habit("run").version, None, "01.01.2100", "01.01.2100")
+    sync.sync(source, replica)
+    assert habit_states(replica)[:1] == habit_states(source)
+
+    # A habit that exists on both sides is overwritten by the source's one, together with its events: the events that
+    # the replica logged for it itself are dropped, so the replica converges to the source.
+    replica.append_event("run", replica.view_habit("run").version, "02.01.2100", None, "02.01.2100")
+    source.append_event("run", source.view_habit("run").version, None, "03.01.2100", "03.01.2100")
+    HabitTracker(source).add_habit("swim", "weekly", "Swim a mile")
+    sync.sync(source, replica)
+    assert habit_states(replica) == habit_states(source)
+    for habit_name in "run", "swim":
+        assert replica.view_dates(habit_name) == source.view_dates(habit_name)
+
+
+def test_load_test(tmp_path):
+    report = loadtest.load_test(database.SQLiteStorage(str(tmp_path / 'HabitTracker.db')), users=4, operations=10)
+    assert report["operations"] == sum(stats["count"] for stats in report["per_operation"].values()) == 40
+    assert all(stats["error_rate"] == 0 for stats in report["per_operation"].values())
+    assert all(stats["p50"] <= stats["p99"] <= stats["max"] for stats in report["per_operation"].values())
+    assert report["lock_wait"] >= 0 and report["backoff"] >= 0
+
+
+def test_lock_wait(tmp_path):
+    sqlite_storage = database.SQLiteStorage(str(tmp_path / 'HabitTracker.db'))
+    sqlite_storage.create_table()
+    sqlite_storage.add_test_data()
+
+    # another connection holds the write lock for a while, the check-off waits for it and records the wait
+    locked = threading.Event()
+
+    def hold_lock():
+        writer = sqlite_storage.connect()
+        writer.execute("BEGIN IMMEDIATE")
+        locked.set()
+        time.sleep(0.2)
+        writer.rollback()
+        writer.close()
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    locked.wait()
+    storage_module.lock_wait_time.seconds = 0
+    HabitTracker(sqlite_storage).check_habit_off("read")
+    holder.join()
+    assert storage_module.lock_wait_time.seconds >= 0.15
+    assert sqlite_storage.view_habit("read").current_streak == 1
+
+
+def test_task_specifications(tmp_path):
+    sqlite_storage = database.SQLiteStorage(str(tmp_path / 'HabitTracker.db'))
+    sqlite_storage.create_table()
+    task_specification = "Walk at least 10000 steps, take the stairs and go for a walk after lunch. " * 3
+    HabitTracker(sqlite_storage).add_habit("walk", "daily", task_specification)
+    HabitTracker(sqlite_storage).add_habit("steps", "weekly", task_specification)
+
+    db = sqlite_storage.connect()
+    # both habits share one compressed specification, and periodicities are stored as numbers
+    assert db.execute("SELECT compressed, length(data) < ? FROM task_specs",
+                      (len(task_specification),)).fetchall() == [(1, 1)]
+    assert db.execute("SELECT periodicity FROM habits ORDER BY habit_name").fetchall() == [(2,), (1,)]
+    assert database.SQLiteStorage(sqlite_storage.path).view_habit("walk").task_specification == task_specification
+    assert sqlite_storage.view_same_periodicity("weekly") == ["steps"]
+
+    HabitTracker(sqlite_storage).delete_habit("walk")
+    assert db.execute("SELECT COUNT(*) FROM task_specs").fetchone() == (1,)
+    HabitTracker(sqlite_storage).delete_habit("steps")
+    assert db.execute("SELECT COUNT(*) FROM task_specs").fetchone() == (0,)
+    db.close()
+
+
+def test_forecast():
+    storage.clear()
+    storage.add_test_data()
+    read_habit = storage.view_habit("read")
+    # missed -> missed, missed -> completed, completed -> missed, completed -> completed
+    assert read_habit.transitions == (9, 2, 2, 14)
+
+    # the roll-over logs a missed period for today, then the check-off a completed one, which the tracker's own habit
+    # counts as well
+    tracker = HabitTracker(storage)
+    tracker.check_habit_off("read")
+    assert storage.view_habit("read").transitions == (10, 3, 2, 14)
+    assert [habit.transitions for habit in tracker.database if habit.habit_name == "read"] == [(10, 3, 2, 14)]
+
+    assert tracker.streak_probability("read", 1, 0) == 1.0
+    assert 0 < tracker.streak_probability("read", 30, 30) < tracker.streak_probability("read", 30, 60) < 1
+    assert tracker.expected_completions("read", 0) == 0
+    assert 0 < tracker.expected_completions("read", 10) < 10
@@ -4,13 +4,16 @@ import database
 from datetime import datetime
 
 from habits import Habit
+from storage import HabitExistsError
 
 
 class HabitTracker:
 
-    def __init__(self):
-        # Imports the database and initializes the needed functionality.
-        self.database = database.view_all_info()
+    def __init__(self, storage=None):
+        # Imports the database and initializes the needed functionality. Without a storage, the SQLite database is used.
+        self.storage = storage if storage is not None else database.SQLiteStorage()
+        self.storage.roll_over_once()
+        self.database = self.storage.view_all_info()
 
     def check_habit_off(self, habit_name):
         """
@@ -19,7 +22,7 @@ class HabitTracker:
         """
         for habit in self.database:
             if habit_name == habit.habit_name:
-                habit.check_habit_off()
+                habit.check_habit_off(self.storage)
                 return
         print("Habit not found.")
 
@@ -28,37 +31,33 @@ class HabitTracker:
         This method adds a habit to the database if no habit with such name exists yet. If it does,
         the user will see this information via the print command.
         """
-        existing_habits = self.get_all_habits_data()
-        if habit_name in existing_habits:
-            print("Sorry, a habit with this name already exists. Please try again.")
-            return
-        new_habit = Habit(habit_name, datetime.now().date(), periodicity, task_specification,
+        new_habit = Habit(habit_name, datetime.now().strftime("%d.%m.%Y"), periodicity, task_specification,
                           0, 0, 0, json.dumps([]),
                           json.dumps([]), None)
-        database.add_habit(new_habit)
-        self.__init__()
+        try:
+            # the storage refuses the habit if another process added one with the same name in the meantime
+            self.storage.add_habit(new_habit)
+        except HabitExistsError:
+            print("Sorry, a habit with this name already exists. Please try again.")
+            return
+        self.__init__(self.storage)
 
     def delete_habit(self, habit_name):
         # This method deletes a habit from the database
         for habit in self.database:
             if habit.habit_name == habit_name:
-                database.delete_habit(habit_name)
+                self.storage.delete_habit(habit_name)
                 print("Habit successfully deleted.")
-                self.__init__()
+                self.__init__(self.storage)
                 return
         print("Sorry, a habit with this name doesn't exists. Please try again.")
 
     def longest_streak_overall(self):
         # This method returns the longest streak among all the exiting habits
-        longest_streak_habit = None
-        longest_streak = 0
-
-        for habit in self.database:
-            if habit.longest_streak > longest_streak:
-                longest_streak = habit.longest_streak
-                longest_streak_habit = habit.habit_name
-
-        return longest_streak_habit, longest_streak
+        longest_streak = self.storage.view_longest_streak()
+        if longest_streak is None:
+            return None, 0
+        return longest_streak
 
     def longest_streak_one(self, habit_name):
         # This method returns the longest habit streak of one chosen habit
@@ -76,15 +75,10 @@ class HabitTracker:
         This method returns the most days a habit was not completed in a row among all the
         exiting tasks. Therefore, this method gets the most difficult habit to complete overall.
         """
-        broken_streak_habit = None
-        broken_streak = 0
-
-        for habit in self.database:
-            if habit.broken_streak > broken_streak:
-                broken_streak = habit.broken_streak
-                broken_streak_habit = habit.habit_name
-
-        return broken_streak_habit, broken_streak
+        broken_streak = self.storage.view_broken_streak()
+        if broken_streak is None:
+            return None, 0
+        return broken_streak
 
     def broken_streak_one(self, habit_name):
         # This method returns the biggest number of days that a chosen habit has not been done for.
@@ -97,6 +91,23 @@ class HabitTracker:
         if not found_habit:
             print("Sorry, a habit with this name does not exist.")
 
+    def streak_probability(self, habit_name, target, periods):
+        """
+        This method returns the probability that a chosen habit reaches a streak of target periods within the next
+        periods periods, forecast from how often its completed and missed periods followed each other so far.
+        """
+        for habit in self.database:
+            if habit.habit_name == habit_name:
+                return habit.streak_probability(target, periods)
+        print("Sorry, a habit with this name does not exist.")
+
+    def expected_completions(self, habit_name, periods):
+        # This method returns the forecast number of completed periods of a chosen habit among the next periods.
+        for habit in self.database:
+            if habit.habit_name == habit_name:
+                return habit.expected_completions(periods)
+        print("Sorry, a habit with this name does not exist.")
+
     def longest_streak_all(self):
         # This method returns a dictionary of habits with their longest completed streaks.
         return {habit.habit_name: habit.longest_streak for habit in self.database}
@@ -122,14 +133,9 @@ class HabitTracker:
         This method filters the habit list based on the specified periodicity input by the user and returns
         the required data.
         """
-        periodicity_filters = {
-            'daily': lambda habit: [habit for habit in habit if habit.periodicity == 'daily'],
-            'weekly': lambda habit: [habit for habit in habit if habit.periodicity == 'weekly'],
-            'monthly': lambda habit: [habit for habit in habit if habit.periodicity == 'monthly']
-        }
-
-        if p in periodicity_filters:
-            filtered_tasks = periodicity_filters[p](self.database)
+        if p in ('daily', 'weekly', 'monthly'):
+            habit_names = self.storage.view_same_periodicity(p)
+            filtered_tasks = [habit for habit in self.database if habit.habit_name in habit_names]
             return filtered_tasks
         else:
             print("There is no such periodicity. Please try again.")